@@ -1,5 +1,4 @@
 
-from datetime import datetime, timedelta
 import keyboard as kb
 import mouse
 from itertools import chain
@@ -9,33 +8,120 @@ import tkinter as tk
 import tkinter.ttk as ttk
 from tkinter import simpledialog
 
-from mistake import Keylock, Repeat, Skip
 from canvas_frame import CanvasFrame
-from utils import modular_range, is_hexcode
+from canvas_line import text_metrics
+from detector import MistakeDetector, REPEAT, SKIP
+from diagnostics import diagnostics
+from file_watcher import create_watcher
+from utils import is_hexcode, KeyInput
 from input_utils import MOUSE_BUTTON_NAMES, workaround_read_event
-from input_utils import hook_scan_code, on_mouse_button
+from input_utils import EventQueue
+from session import SessionRecorder
+from stats import TimingAnalysis
+import timing
+from timing import NS_PER_MS
 
 
 class App(tk.Tk):
-
-    def __init__(self, settings):
+    # interval and batch size of the loop moving input events into the mainloop
+    EVENT_PUMP_MS = 4
+    EVENT_BATCH = 256
+    DIAGNOSTICS_REFRESH_MS = 1000
+    SETTINGS_POLL_MS = 500
+    # settings that change what the canvas shows
+    DISPLAY_SETTINGS = {
+        'bind_names', 'colours', 'aliases', 'do_colour', 'font_size', 'key_display_method',
+        'relative_pad_left', 'line_spacing', 'min_width', 'min_height', 'analysis_enabled',
+        'analysis_release_rows',
+        'divider_stroke', 'scale_mark_prominence', 'periphery_mode_enabled',
+        'periphery_background_colour', 'periphery_decay_ms'}
+    # settings that are only read on startup
+    RESTART_SETTINGS = {
+        'max_mistakes', 'database_enabled', 'database_path', 'publisher_enabled', 'publisher_address',
+        'publisher_max_buffered', 'publisher_drop_policy', 'diagnostics_dump_path', 'input_backend',
+        'input_devices'}
+
+    def __init__(self, settings, inputs=None, record_path=None, replay=None, beatmap=None, startup_ns=None):
+        """
+        `inputs` are the `InputHooks` installed before the GUI was loaded, None for replays.
+        """
         super().__init__()
         self.settings = settings
         self.title('4k mistake watcher')
-        self.last_keyindex = None
-        self.pressed = [False] * self.settings.n_keys
-        self.full_release_time = None
+        self.inputs = inputs
+        self.event_queue = inputs.event_queue if inputs else EventQueue()
+        self.clear_index = self.settings.n_keys
+        # replays come from a session log instead of the input hooks
+        self.replay = replay
+        self.refresh_hooks()
+        # time since `startup_ns` is reported with --profile-startup
+        self.startup_ns = startup_ns
+        self.first_hook_ns = inputs.first_hook_ns if inputs else timing.now_ns()
+        diagnostics.enabled = self.settings.diagnostics_enabled
+        self.recorder = None
+        if record_path:
+            self.recorder = SessionRecorder(record_path, self.settings.n_keys)
+        # optional subsystems are only imported when enabled
+        # replayed events were already stored when they were recorded,
+        # and profiling runs don't leave a session in the history
+        self.database = None
+        if self.settings.database_enabled and not replay and startup_ns is None:
+            import sqlite3
+            from database import MistakeDatabase
+            try:
+                self.database = MistakeDatabase(self.settings.database_path, self.settings.n_keys)
+            except (sqlite3.Error, OSError) as e:
+                logging.warning(f"running without the mistake history, can't open '{self.settings.database_path}': {e}")
+        self.publisher = None
+        if self.settings.publisher_enabled:
+            from publisher import Publisher
+            self.publisher = Publisher(self.settings.publisher_address, self.settings.n_keys,
+                                       self.settings.publisher_max_buffered,
+                                       self.settings.publisher_drop_policy)
+        self.hit_analysis = None
+        if beatmap:
+            from beatmap import HitAnalysis
+            self.hit_analysis = HitAnalysis(beatmap)
+        self.n_dropped_reported = 0
+        self.n_late_reported = 0
+        self.detector = MistakeDetector(self.settings)
         self.clear_analysis()
         
         self.tab_control = ttk.Notebook(self)
         self.tab1 = ttk.Frame(self.tab_control)
         self.tab2 = ttk.Frame(self.tab_control)
         self.tab_control.add(self.tab1, text='settings')
+        self.tab3 = ttk.Frame(self.tab_control)
         self.tab_control.add(self.tab2, text='display')
+        self.tab_control.add(self.tab3, text='diagnostics')
         self.tab_control.select(self.tab2)
 
         self.tab_control.pack(expand=1, fill='both')
+
+        # canvas
+        self.canvas_frame = CanvasFrame(self.settings, self.tab2, width=1, height=1,
+                                        is_replay=bool(self.replay))
+        self.canvas_frame.refresh()
+        self.canvas_frame.grid(row=2, column=0, sticky='nw')
+        self.canvas_frame.grid_rowconfigure(0, weight=1)
+        self.canvas_frame.grid_columnconfigure(0, weight=1)
+        self.canvas_frame.grid_propagate(False)
         
+        self.protocol('WM_DELETE_WINDOW', self.on_close)
+        self.after(self.EVENT_PUMP_MS, self.pump_events)
+        self.settings_watcher = create_watcher(self.settings.settings_path)
+        # a rejected file holds edits that saving on close would overwrite
+        self.settings_rejected = False
+        self.after(self.SETTINGS_POLL_MS, self.check_settings_file)
+        if self.startup_ns is not None:
+            self.after_idle(self.report_startup)
+        # the other tabs aren't visible on startup, they are built once the first frame is drawn
+        self.tabs_built = False
+        self.after_idle(self.build_settings_tab)
+        self.after_idle(self.build_diagnostics_tab)
+
+
+    def build_settings_tab(self):
         ttk.Label(self.tab1, text='key binds', font="tkDefaulFont 14 bold").pack()
         
         # keybinds
@@ -80,7 +166,7 @@ class App(tk.Tk):
             self.alias_entries[keyindex].grid(column=3, row=keyindex, padx=10, pady=5)
             
         # clear keybind
-        index = self.clear_index = self.settings.n_keys
+        index = self.clear_index
         self.keybind_buttons.append(ttk.Button(
             self.keybind_frame, width=12, text=f'clear', command=bind_command_factory(index)))
         self.keybind_buttons[index].grid(column=1, row=index, padx=10, pady=5)
@@ -166,22 +252,90 @@ class App(tk.Tk):
         # settings info
         ttk.Label(
             self.tab1, justify='center',
-            text='see settings.yaml to modify rules \nfor periphery mode and sound',
+            text='see settings.yaml to modify rules \nfor periphery mode and sound, \nchanges apply immediately',
             font='tkDefaultFont 8').pack()
+        self.toggle_settings_widgets()
+
+
+    def build_diagnostics_tab(self):
+        self.diagnostics_enabled = tk.BooleanVar(self, self.settings.diagnostics_enabled)
+        self.diagnostics_enabled_check = tk.Checkbutton(
+            self.tab3, text='record latencies', command=self.update_diagnostics_settings,
+            variable=self.diagnostics_enabled)
+        self.diagnostics_enabled_check.pack()
+        ttk.Button(self.tab3, text='clear', command=diagnostics.clear).pack()
+        self.diagnostics_label = ttk.Label(self.tab3, font='TkFixedFont', justify='left')
+        self.diagnostics_label.pack(padx=10, pady=5)
+        self.after(self.DIAGNOSTICS_REFRESH_MS, self.update_diagnostics_tab)
+        self.tabs_built = True
+
+
+    def report_startup(self):
+        # scheduled before the tab builders, idle callbacks run in order after the pending redraws of the first frame
+        first_frame_ns = timing.now_ns()
+        print(f'time to first hook: {(self.first_hook_ns - self.startup_ns) / NS_PER_MS:.1f}ms')
+        print(f'time to first frame: {(first_frame_ns - self.startup_ns) / NS_PER_MS:.1f}ms')
+        self.after_idle(self.on_close)
+
+
+    def check_settings_file(self):
+        if self.settings_watcher.changed():
+            changed = self.settings.reload()
+            self.settings_rejected = changed is None
+            if changed:
+                logging.info(f"reloaded settings: {', '.join(sorted(changed))}")
+                self.apply_settings(changed)
+        self.after(self.SETTINGS_POLL_MS, self.check_settings_file)
+
+
+    def apply_settings(self, changed):
+        """
+        Reapplies the settings that changed in settings.yaml, leaving everything else untouched.
+        """
+        if 'bind_codes' in changed:
+            self.refresh_hooks()
+            # key ups of keys that were unbound while held never arrive, they would stay held forever
+            self.detector.reset()
+        if 'sound_backend' in changed:
+            self.canvas_frame.stop_sound()
+        if self.settings.sound_enabled:
+            # loads the clips of new rules, already loaded clips are kept
+            self.canvas_frame.start_sound()
+        if changed & {'analysis_ewma_alpha', 'analysis_outlier_ratio'}:
+            self.clear_analysis()
+        diagnostics.enabled = self.settings.diagnostics_enabled
+        if changed & self.RESTART_SETTINGS:
+            logging.warning(f"changes to {', '.join(sorted(changed & self.RESTART_SETTINGS))} "
+                            f"apply after a restart")
+        if self.tabs_built:
+            self.sync_settings_widgets()
+        if changed & self.DISPLAY_SETTINGS:
+            if 'font_size' in changed:
+                text_metrics.clear()
+            self.show_analysis()
+            self.canvas_frame.refresh()
+
+
+    def sync_settings_widgets(self):
+        # the variables are set directly, their commands would write the settings back
+        self.key_display_var.set(self.settings.key_display_method)
+        self.do_colour_var.set(self.settings.do_colour)
+        self.do_full_release_var.set(self.settings.do_full_release)
+        self.analysis_enabled.set(self.settings.analysis_enabled)
+        self.periphery_mode_enabled.set(self.settings.periphery_mode_enabled)
+        self.sound_enabled.set(self.settings.sound_enabled)
+        self.diagnostics_enabled.set(self.settings.diagnostics_enabled)
+        self.font_size_label.config(text=str(self.settings.font_size))
+        self.release_delay_label.config(text=str(self.settings.release_seconds))
+        for keyindex in range(self.settings.n_keys):
+            self.colour_buttons[keyindex].config(background=self.settings.colours[keyindex])
+            if self.alias_vars[keyindex].get() != self.settings.aliases[keyindex]:
+                self.alias_vars[keyindex].set(self.settings.aliases[keyindex])
+        for label, name in zip(self.keybind_labels, self.settings.bind_names):
+            label.config(text=name)
+        self.toggle_settings_widgets()
 
-        # canvas
-        self.canvas_frame = CanvasFrame(self.settings, self.tab2, width=1, height=1)
-        self.canvas_frame.refresh()
-        self.canvas_frame.grid(row=2, column=0, sticky='nw')
-        self.canvas_frame.grid_rowconfigure(0, weight=1)
-        self.canvas_frame.grid_columnconfigure(0, weight=1)
-        self.canvas_frame.grid_propagate(False)
-        
-        self.refresh_hooks()
-        self.update_display_settings()
-        self.protocol('WM_DELETE_WINDOW', self.on_close)
 
-        
     def update_display_settings(self):
         self.settings.key_display_method = self.key_display_var.get()
         self.settings.do_colour = self.do_colour_var.get()
@@ -193,6 +347,13 @@ class App(tk.Tk):
         logging.info(f'current full release mode: {self.settings.do_full_release}')
         logging.info(f'analysis enabled: {self.settings.analysis_enabled}')
         logging.info(f'periphery mode enabled: {self.settings.periphery_mode_enabled}')
+        self.toggle_settings_widgets()
+        # the analysis display is toggled by the refresh below
+        self.show_analysis()
+        self.canvas_frame.refresh()
+
+
+    def toggle_settings_widgets(self):
         # toggle colour buttons
         if self.settings.do_colour:
             for colour_button in self.colour_buttons:
@@ -207,11 +368,6 @@ class App(tk.Tk):
         else:
             for entry in self.alias_entries:
                 entry.grid_remove()
-        # toggle analysis display
-        if self.settings.analysis_enabled:
-            self.canvas_frame.draw_analysis(self.presses_ms, self.releases_ms)
-        else:
-            self.canvas_frame.barlines = []
         # toggle full release button
         if self.settings.do_full_release:
             self.release_delay_button.grid()
@@ -219,11 +375,12 @@ class App(tk.Tk):
         else:
             self.release_delay_button.grid_remove()
             self.release_delay_label.grid_remove()
-        self.canvas_frame.refresh()
 
 
     def update_sound_settings(self):
         self.settings.sound_enabled = self.sound_enabled.get()
+        if self.settings.sound_enabled:
+            self.canvas_frame.start_sound()
 
 
     def on_entry_write(self, keyindex):
@@ -273,163 +430,156 @@ class App(tk.Tk):
         return
 
     
+    def update_diagnostics_settings(self):
+        self.settings.diagnostics_enabled = diagnostics.enabled = self.diagnostics_enabled.get()
+        logging.info(f'diagnostics enabled: {self.settings.diagnostics_enabled}')
+
+
+    def update_diagnostics_tab(self):
+        # the report is only rendered while the tab is visible
+        if self.tab_control.select() == str(self.tab3):
+            report = diagnostics.report()
+            if self.hit_analysis:
+                report += '\n\n' + self.hit_analysis.report()
+            self.diagnostics_label.configure(text=report)
+        self.after(self.DIAGNOSTICS_REFRESH_MS, self.update_diagnostics_tab)
+
+
     def enable_keybind_buttons(self):
         for button in chain(self.keybind_buttons, self.colour_buttons):
             button['state'] = tk.NORMAL
 
         
     def refresh_hooks(self):
-        kb.unhook_all()
-        for code in self.settings.bind_codes:
-            if code in MOUSE_BUTTON_NAMES:
-                on_mouse_button(code, self.handle_event)
-            elif code:
-                hook_scan_code(code, self.handle_event)
+        # queued events are resolved through this, so that events of codes unbound since are dropped
+        self.keyindices = {code: keyindex for keyindex, code in enumerate(self.settings.bind_codes) if code}
+        if self.inputs:
+            self.inputs.refresh()
+
+
+    def pump_events(self):
+        # the listener threads only queue events, all handling happens here on the mainloop
+        try:
+            for timestamp, event in self.event_queue.drain(self.EVENT_BATCH):
+                if type(event) is KeyInput:
+                    # resolved by the reader thread, possibly against binds that were reloaded since
+                    keyindex = self.keyindices.get(event.code)
+                    if keyindex is not None:
+                        self.handle_input(event.code, keyindex, event.is_down, timestamp)
+                else:
+                    self.handle_event(event, timestamp)
+            if self.replay and not self.replay.is_done():
+                for event in self.replay.due(self.EVENT_BATCH):
+                    self.handle_key(event.keyindex, event.is_down, event.timestamp)
+                if self.replay.is_done():
+                    logging.info(f'replay finished after {self.replay.n_replayed} events')
+            self.report_queue_stats()
+        finally:
+            # an error handling one batch must not stop all further input
+            self.after(self.EVENT_PUMP_MS, self.pump_events)
+
+
+    def report_queue_stats(self):
+        if self.event_queue.n_dropped != self.n_dropped_reported:
+            self.n_dropped_reported = self.event_queue.n_dropped
+            logging.warning(f'input events dropped so far: {self.n_dropped_reported}')
+        if self.event_queue.n_late != self.n_late_reported:
+            self.n_late_reported = self.event_queue.n_late
+            logging.warning(f'input events handled late so far: {self.n_late_reported}')
 
                 
-    def handle_event(self, event):
-        keyindex = self.find_keyindex(event)
-        logging.debug(f'registered keyindex {keyindex}')
-        
+    def handle_event(self, event, timestamp):
+        code = self.find_code(event)
+        keyindex = self.keyindices.get(code)
+        if keyindex is None:
+            return
+        is_down = not (event.event_type == kb.KEY_UP or event.event_type == mouse.UP)
+        self.handle_input(code, keyindex, is_down, timestamp)
+
+
+    def handle_input(self, code, keyindex, is_down, timestamp):
+        # replayed timestamps are not from the input hook
+        if diagnostics.enabled and not self.replay:
+            diagnostics.record('hook', timing.now_ns() - timestamp)
+        if self.recorder:
+            self.recorder.record(code, keyindex, is_down, timestamp)
+        if self.database:
+            self.database.add_event(code, keyindex, is_down, timestamp)
+        if self.publisher and self.settings.publisher_events:
+            self.publisher.publish_event(keyindex, is_down, timestamp)
+        self.handle_key(keyindex, is_down, timestamp)
+
+
+    def handle_key(self, keyindex, is_down, timestamp):
         # clear
         if keyindex == self.clear_index:
-            if event.event_type == kb.KEY_DOWN or event.event_type == mouse.DOWN:
+            if is_down:
                 self.canvas_frame.clear()
                 self.clear_analysis()
-                logging.debug(f'done handling canvas clear event')
+                self.show_analysis()
+                if self.hit_analysis:
+                    self.hit_analysis.clear()
             return
 
-        # releases do not trigger mistakes
-        if event.event_type == kb.KEY_UP or event.event_type == mouse.UP:
-            logging.debug(f'it\'s a release event')
-            self.pressed[keyindex] = False
-            logging.debug(f'updated currently pressed: {self.pressed}')
-            if not any(self.pressed):
-                self.full_release_time = datetime.now()
-                logging.debug(f'all keys released, recorded time {self.full_release_time}')
+        if is_down and self.hit_analysis and not self.detector.pressed[keyindex]:
+            self.hit_analysis.press(keyindex, timestamp)
+        start = diagnostics.enabled and timing.now_ns()
+        mistakes = self.detector.feed(keyindex, is_down, timestamp)
+        if start:
+            diagnostics.record('detect', timing.now_ns() - start)
+        if not is_down:
             if self.settings.analysis_enabled:
-                self.release_analysis(keyindex) 
-            logging.debug(f'done handling release event')
+                self.release_analysis(keyindex, timestamp)
             return
-        # repeated keydown events due to holding are not registered
-        if self.pressed[keyindex]:
-            logging.debug(f'ignoring already pressed key {keyindex}')
+        # ignored presses, e.g. held keys or the first press after a full release
+        if mistakes is None:
             return
-        # if all keys have been released for a while, no mistakes are triggered
-        if self.full_release_time:
-            logging.debug('registered first keydown event after full release')
-            timedelta = datetime.now() - self.full_release_time
-            self.full_release_time = None
-            if self.settings.do_full_release and timedelta.seconds >= self.settings.release_seconds:
-                self.pressed[keyindex] = True
-                self.last_keyindex = keyindex
-                logging.debug(f'enough time has passed since full release, ignoring keypress {keyindex}')
-                return
-            logging.debug(f'not enough time has passed since full release, continuing')
-            
-        mistake_types = self.check_for_mistake(keyindex)
-        if self.settings.analysis_enabled:
-            self.press_analysis(keyindex, mistake_types)
 
-        self.pressed[keyindex] = True
-        self.last_keyindex = keyindex
-
-        logging.debug(f'updated current pressed: {self.pressed}')
-        logging.debug(f'updated last_keyindex: {self.last_keyindex}')
-        logging.debug(f'done handling event')
+        mistake_types = self.check_for_mistake(mistakes)
+        if self.settings.analysis_enabled:
+            self.press_analysis(keyindex, mistake_types, timestamp)
         return
 
     
     def clear_analysis(self):
-        n_keys = self.settings.n_keys
-        # time before next key is pressed
-        self.presses_ms = [0] * n_keys
-        # time before current key is released
-        self.releases_ms = [0] * n_keys
-        self.n_press_samples = [0] * n_keys
-        self.n_release_samples = [0] * n_keys
-        self.press_times = [None] * n_keys
-        self.last_press_time = None
-
-
-    def press_analysis(self, keyindex, mistake_types):
-        n_keys = self.settings.n_keys
-        i = (keyindex - 1) % n_keys
-        if self.last_press_time and not (mistake_types[1] or mistake_types[2]):
-            delta_ms = (datetime.now() - self.last_press_time) / timedelta(milliseconds=1)
-            self.presses_ms[i], self.n_press_samples[i] = (
-                 self.adjust_average(self.presses_ms[i], self.n_press_samples[i], delta_ms))
-            # initialize the averages based on the first key
-            if self.n_press_samples[i] == 1:
-                self.presses_ms = [self.presses_ms[i]] * n_keys
-                self.n_press_samples = [1] * n_keys
-                self.releases_ms = [self.presses_ms[i] * 3/2] * n_keys
-                self.n_release_samples = [1] * n_keys
-        self.last_press_time = datetime.now()
-        self.press_times[keyindex] = datetime.now()
-        self.canvas_frame.draw_analysis(self.presses_ms, self.releases_ms)
+        self.timing_analysis = TimingAnalysis(
+            self.settings.n_keys, self.settings.analysis_ewma_alpha, self.settings.analysis_outlier_ratio)
+
+
+    def press_analysis(self, keyindex, mistake_types, timestamp):
+        counted = not (mistake_types[REPEAT] or mistake_types[SKIP])
+        self.timing_analysis.press(keyindex, counted, timestamp)
+        self.show_analysis()
         
 
-    def release_analysis(self, keyindex):
-        n_keys = self.settings.n_keys
-        i = keyindex
-        if self.press_times[i]:
-            delta_ms = (datetime.now() - self.press_times[i]) / timedelta(milliseconds=1)
-            self.releases_ms[i], self.n_release_samples[i] = (
-                self.adjust_average(self.releases_ms[i], self.n_release_samples[i], delta_ms))
-            # initialize the averages based on the first key
-            if self.n_release_samples[i] == 1:
-                self.presses_ms = [self.releases_ms[i]] * n_keys
-                self.n_press_samples = [1] * n_keys
-                self.releases_ms = [self.releases_ms[i]] * n_keys
-                self.n_release_samples = [1] * n_keys
-        self.canvas_frame.draw_analysis(self.presses_ms, self.releases_ms)
-            
-            
-    def adjust_average(self, average, n_samples, added_value):
-        if not n_samples:
-            return added_value, 1
-        # outlier filtering
-        if added_value < 2 * average:
-            return (n_samples * average + added_value) / (n_samples + 1), (n_samples + 1)
-        return average, n_samples
+    def release_analysis(self, keyindex, timestamp):
+        self.timing_analysis.release(keyindex, timestamp)
+        self.show_analysis()
+
+
+    def show_analysis(self):
+        self.canvas_frame.update_analysis(self.timing_analysis.presses_ms(),
+                                          self.timing_analysis.releases_ms())
 
     
-    def find_keyindex(self, event):
+    def find_code(self, event):
         if isinstance(event, mouse.ButtonEvent):
-            code = event.button
-        else:
-            code = event.scan_code
-        return self.settings.bind_codes.index(code)
+            return event.button
+        return event.scan_code
 
         
-    def check_for_mistake(self, keyindex):
-        logging.debug(f'checking for mistakes')
-        logging.debug(f'currently pressed: {self.pressed}')
-        logging.debug(f'current keyindex: {keyindex}')
-        logging.debug(f'last keyindex: {self.last_keyindex}')
-        two_back = (keyindex - 2) % self.settings.n_keys
+    def check_for_mistake(self, mistakes):
         mistake_types = [False] * 3
-        # keylock
-        if self.pressed[two_back]:
-            logging.debug(f'{two_back}-{keyindex} keylock')
-            mistake = Keylock(self.settings, [two_back, keyindex])
-            self.canvas_frame.insert_mistake(mistake)
-            mistake_types[0] = True
-        # repeat
-        if keyindex == self.last_keyindex:
-            logging.debug(f'{keyindex} repeat')
-            mistake = Repeat(self.settings, keyindex)
-            self.canvas_frame.insert_mistake(mistake)
-            mistake_types[1] = True
-        # skip
-        elif self.last_keyindex is not None:
-            skipped = list(modular_range(self.settings.n_keys, self.last_keyindex + 1, keyindex))
-            if skipped:
-                logging.debug(f'skipped keys: {skipped}')
-                mistake = Skip(self.settings, skipped)
-                self.canvas_frame.insert_mistake(mistake)
-                mistake_types[2] = True
+        for record in mistakes:
+            start = diagnostics.enabled and timing.now_ns()
+            self.canvas_frame.insert_mistake(record)
+            if start:
+                diagnostics.record('insert', timing.now_ns() - start)
+            if self.database:
+                self.database.add_mistake(record)
+            if self.publisher:
+                self.publisher.publish_mistake(record)
+            mistake_types[record.type] = True
         return mistake_types
     
 
@@ -448,6 +598,7 @@ class App(tk.Tk):
         if font_size and 0 < font_size:
             self.settings.font_size = font_size
             self.font_size_label.config(text=str(font_size))
+            text_metrics.clear()
             self.canvas_frame.refresh()
         else:
             logging.info('font size input is not positive')
@@ -465,5 +616,29 @@ class App(tk.Tk):
         
 
     def on_close(self):
-        self.settings.save()
+        logging.info(f'input events dropped: {self.event_queue.n_dropped}, '
+                     f'handled late: {self.event_queue.n_late}')
+        if self.recorder:
+            self.recorder.close()
+        if self.database:
+            self.database.close()
+        if self.publisher:
+            self.publisher.close()
+        if self.inputs:
+            self.inputs.close()
+        if self.hit_analysis:
+            logging.info(f'hit errors:\n{self.hit_analysis.report()}')
+        self.canvas_frame.stop_sound()
+        # edits since the last poll are loaded first, so that saving keeps them
+        if self.settings_watcher.changed():
+            self.settings_rejected = self.settings.reload() is None
+        self.settings_watcher.close()
+        # profiling runs leave the user's files untouched
+        if self.startup_ns is None:
+            if self.settings.diagnostics_enabled:
+                diagnostics.dump(self.settings.diagnostics_dump_path)
+            if self.settings_rejected:
+                logging.warning(f"not saving settings, '{self.settings.settings_path}' has changes that failed to load")
+            else:
+                self.settings.save()
         self.destroy()
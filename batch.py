@@ -0,0 +1,161 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import lzma
+import os
+
+from detector import MistakeDetector, KEYLOCK, REPEAT, SKIP
+from session import MAGIC, read_session, check_header
+from stats import TimingAnalysis, Welford
+
+
+MISTAKE_NAMES = {KEYLOCK: 'keylock', REPEAT: 'repeat', SKIP: 'skip'}
+# chunks per worker, more chunks balance uneven file sizes better at the cost of more merges
+CHUNKS_PER_WORKER = 4
+
+
+class BatchSummary():
+    """
+    Mergeable totals of any number of sessions or replays: mistake counts by type and keys,
+    and per-key running means of the press intervals and holds accepted by `TimingAnalysis`.
+    """
+    def __init__(self, n_keys):
+        self.n_keys = n_keys
+        self.n_files = 0
+        self.failed = []
+        self.n_presses = 0
+        self.mistakes = Counter()
+        self.presses = [Welford() for _ in range(n_keys)]
+        self.releases = [Welford() for _ in range(n_keys)]
+
+
+    def merge(self, other):
+        self.n_files += other.n_files
+        self.failed += other.failed
+        self.n_presses += other.n_presses
+        self.mistakes.update(other.mistakes)
+        for mine, theirs in zip(self.presses + self.releases, other.presses + other.releases):
+            mine.merge(theirs)
+
+
+    def presses_ms(self):
+        return [stats.mean for stats in self.presses]
+
+
+    def releases_ms(self):
+        return [stats.mean for stats in self.releases]
+
+
+    def report(self, top=10):
+        lines = [f'{self.n_files} files, {self.n_presses} presses']
+        if self.failed:
+            lines.append(f"failed to read {len(self.failed)} files: {', '.join(self.failed)}")
+        presses_ms = self.presses_ms()
+        releases_ms = self.releases_ms()
+        for k in range(self.n_keys):
+            lines.append(f'key {k + 1}: press {presses_ms[k]:.1f}ms (n={self.presses[k].n}), '
+                         f'release {releases_ms[k]:.1f}ms (n={self.releases[k].n})')
+        presses = max(self.n_presses, 1)
+        for mistake_type, name in MISTAKE_NAMES.items():
+            counts = Counter({keyindices: count for (type_code, keyindices), count in self.mistakes.items()
+                              if type_code == mistake_type})
+            total = sum(counts.values())
+            lines.append(f'{name}s: {total} ({100 * total / presses:.2f}% of presses)')
+            for keyindices, count in counts.most_common(top):
+                keys = ', '.join(str(keyindex + 1) for keyindex in keyindices)
+                lines.append(f'  {keys}: {count}')
+        return '\n'.join(lines)
+
+
+def is_session_log(path):
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def find_files(directory):
+    """
+    Returns the session logs and .osr replays below `directory`, largest first.
+    """
+    paths = []
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                if filename.lower().endswith('.osr') or is_session_log(path):
+                    paths.append(path)
+            except OSError as e:
+                logging.warning(f"can't read '{path}': {e}")
+    # large files first, so that no worker is left with a large file at the end
+    return sorted(paths, key=os.path.getsize, reverse=True)
+
+
+def read_events(path, n_keys):
+    if path.lower().endswith('.osr'):
+        # only loaded once replays are analyzed
+        from osr import read_replay
+        return read_replay(path, n_keys)
+    check_header(path, n_keys)
+    return read_session(path)
+
+
+def summarize_file(path, settings):
+    summary = BatchSummary(settings.n_keys)
+    detector = MistakeDetector(settings)
+    analysis = TimingAnalysis(settings.n_keys, settings.analysis_ewma_alpha,
+                              settings.analysis_outlier_ratio)
+    n_keys = settings.n_keys
+    for event in read_events(path, n_keys):
+        # clear key presses of session logs
+        if event.keyindex >= n_keys:
+            continue
+        mistakes = detector.feed(event.keyindex, event.is_down, event.timestamp)
+        if mistakes is None:
+            continue
+        if not event.is_down:
+            analysis.release(event.keyindex, event.timestamp)
+            continue
+        summary.n_presses += 1
+        counted = True
+        for record in mistakes:
+            summary.mistakes[(record.type, tuple(record.keyindices))] += 1
+            counted = counted and record.type not in (REPEAT, SKIP)
+        analysis.press(event.keyindex, counted, event.timestamp)
+    for mine, stats in zip(summary.presses + summary.releases, analysis.press_stats + analysis.release_stats):
+        mine.merge(stats.welford)
+    summary.n_files = 1
+    return summary
+
+
+def summarize_files(paths, settings):
+    """
+    Worker entry point, returns a single summary for a chunk of files.
+    """
+    summary = BatchSummary(settings.n_keys)
+    for path in paths:
+        # a file failing partway adds nothing, so the rates stay consistent
+        try:
+            summary.merge(summarize_file(path, settings))
+        except (OSError, ValueError, lzma.LZMAError) as e:
+            logging.warning(f"skipping '{path}': {e}")
+            summary.failed.append(path)
+    return summary
+
+
+def analyze_directory(directory, settings, max_workers=None):
+    """
+    Summarizes every session log and replay below `directory` in a pool of processes.
+    Files are dealt to `CHUNKS_PER_WORKER` chunks per worker, each chunk comes back as one merged summary.
+    """
+    paths = find_files(directory)
+    summary = BatchSummary(settings.n_keys)
+    if not paths:
+        return summary
+    max_workers = max_workers or os.cpu_count() or 1
+    n_chunks = min(len(paths), max_workers * CHUNKS_PER_WORKER)
+    # dealing round robin keeps the chunks' sizes even, since the paths are sorted by size
+    chunks = [paths[i::n_chunks] for i in range(n_chunks)]
+    logging.info(f'analyzing {len(paths)} files in {n_chunks} chunks on {max_workers} processes')
+    with ProcessPoolExecutor(max_workers) as executor:
+        for chunk_summary in executor.map(summarize_files, chunks, [settings] * n_chunks):
+            summary.merge(chunk_summary)
+    return summary
@@ -0,0 +1,169 @@
+from bisect import bisect_left
+import logging
+
+from stats import Welford
+from timing import NS_PER_MS
+
+
+MANIA_MODE = 3
+# osu!mania playfield width, columns split it evenly
+PLAYFIELD_WIDTH = 512
+
+
+class Beatmap():
+    """
+    Notes of an osu!mania chart, indexed by column.
+    `columns[k]` holds the sorted start times in ms of the notes in column k.
+    """
+    def __init__(self, n_keys, columns, overall_difficulty=5, title=''):
+        self.n_keys = n_keys
+        self.columns = columns
+        self.overall_difficulty = overall_difficulty
+        self.title = title
+        self.n_notes = sum(len(times) for times in columns)
+
+
+    def miss_window_ms(self):
+        # presses further from a note than the miss window don't hit it in game either
+        return 188 - 3 * self.overall_difficulty
+
+
+    def nearest(self, column, time_ms):
+        """
+        Returns the start time of the note in `column` closest to `time_ms`, or None for an empty column.
+        """
+        times = self.columns[column]
+        i = bisect_left(times, time_ms)
+        if i == len(times):
+            return times[-1] if times else None
+        if i and time_ms - times[i - 1] <= times[i] - time_ms:
+            return times[i - 1]
+        return times[i]
+
+
+def read_sections(file):
+    """
+    Yields (section, line) for the non-empty lines of an .osu file.
+    """
+    section = None
+    for line in file:
+        line = line.strip()
+        if not line or line.startswith('//'):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            section = line[1:-1]
+            continue
+        yield section, line
+
+
+def load_beatmap(path):
+    values = {}
+    hit_objects = []
+    with open(path, encoding='utf-8-sig') as file:
+        for section, line in read_sections(file):
+            if section == 'HitObjects':
+                hit_objects.append(line)
+            elif section in ('General', 'Metadata', 'Difficulty'):
+                key, _, value = line.partition(':')
+                values[key.strip()] = value.strip()
+    if int(values.get('Mode', 0)) != MANIA_MODE:
+        raise ValueError(f"'{path}' is not an osu!mania beatmap")
+    n_keys = int(float(values['CircleSize']))
+    columns = [[] for _ in range(n_keys)]
+    for line in hit_objects:
+        fields = line.split(',')
+        try:
+            x = int(float(fields[0]))
+            time_ms = int(float(fields[2]))
+        except (IndexError, ValueError):
+            logging.warning(f"skipping malformed hit object '{line}' in '{path}'")
+            continue
+        column = min(max(x * n_keys // PLAYFIELD_WIDTH, 0), n_keys - 1)
+        columns[column].append(time_ms)
+    for times in columns:
+        times.sort()
+    title = f"{values.get('Artist', '')} - {values.get('Title', '')} [{values.get('Version', '')}]"
+    beatmap = Beatmap(n_keys, columns, float(values.get('OverallDifficulty', 5)), title)
+    logging.info(f"loaded {beatmap.n_notes} notes of {title}")
+    return beatmap
+
+
+class HitAnalysis():
+    """
+    Matches presses to the nearest note of their column, the hit error is positive for late presses.
+    The chart is aligned to the first press, which is taken to hit the first note of its column.
+    Presses without a note within the miss window are counted as empty presses.
+    """
+    def __init__(self, beatmap):
+        self.beatmap = beatmap
+        self.miss_window_ms = beatmap.miss_window_ms()
+        self.clear()
+
+
+    def clear(self):
+        self.restart()
+        self.errors = [Welford() for _ in range(self.beatmap.n_keys)]
+        self.n_early = [0] * self.beatmap.n_keys
+        self.n_late = [0] * self.beatmap.n_keys
+        self.n_empty = [0] * self.beatmap.n_keys
+
+
+    def restart(self):
+        # the next press starts a new play and realigns the chart
+        self.start_ns = None
+
+
+    def press(self, keyindex, timestamp):
+        """
+        Returns the hit error in ms, or None for an empty press.
+        """
+        columns = self.beatmap.columns
+        if self.start_ns is None:
+            if not columns[keyindex]:
+                self.n_empty[keyindex] += 1
+                return None
+            self.start_ns = timestamp - columns[keyindex][0] * NS_PER_MS
+        time_ms = (timestamp - self.start_ns) / NS_PER_MS
+        note_ms = self.beatmap.nearest(keyindex, time_ms)
+        if note_ms is None or abs(time_ms - note_ms) > self.miss_window_ms:
+            self.n_empty[keyindex] += 1
+            return None
+        error_ms = time_ms - note_ms
+        self.errors[keyindex].add(error_ms)
+        if error_ms < 0:
+            self.n_early[keyindex] += 1
+        elif error_ms > 0:
+            self.n_late[keyindex] += 1
+        return error_ms
+
+
+    def offsets_ms(self):
+        return [errors.mean for errors in self.errors]
+
+
+    def report(self):
+        lines = [f'{self.beatmap.title}: {self.beatmap.n_notes} notes, '
+                 f'miss window {self.miss_window_ms:.0f}ms']
+        for k, errors in enumerate(self.errors):
+            lines.append(
+                f'column {k + 1}: {errors.n} hits, offset {errors.mean:+.1f}ms, std {errors.std():.1f}ms, '
+                f'{self.n_early[k]} early, {self.n_late[k]} late, {self.n_empty[k]} empty presses')
+        return '\n'.join(lines)
+
+
+def analyze_hits(session_events, beatmap):
+    """
+    Runs the presses of a recorded session through a `HitAnalysis`, held keys' repeated key downs are skipped.
+    """
+    hit_analysis = HitAnalysis(beatmap)
+    pressed = [False] * beatmap.n_keys
+    for event in session_events:
+        if event.keyindex >= beatmap.n_keys:
+            # the clear key starts a new play
+            if event.is_down:
+                hit_analysis.restart()
+            continue
+        if event.is_down and not pressed[event.keyindex]:
+            hit_analysis.press(event.keyindex, event.timestamp)
+        pressed[event.keyindex] = event.is_down
+    return hit_analysis
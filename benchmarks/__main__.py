@@ -0,0 +1,121 @@
+import argparse
+import json
+import logging
+import os
+from statistics import median
+import tkinter as tk
+
+from benchmarks.generators import PATTERNS
+from benchmarks.paths import PATHS, benchmark_settings, virtual_display
+from timing import NS_PER_S
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+
+def percentile(sorted_values, p):
+    return sorted_values[round(p / 100 * (len(sorted_values) - 1))]
+
+
+def summarize(latencies):
+    # rates only count time spent in the measured path, not setting it up
+    latencies = sorted(latencies)
+    return {
+        'events_per_s': len(latencies) / max(sum(latencies) / NS_PER_S, 1e-9),
+        'p50_us': percentile(latencies, 50) / 1000,
+        'p99_us': percentile(latencies, 99) / 1000,
+    }
+
+
+def run(args, root):
+    results = {}
+    settings = benchmark_settings(args.keys)
+    for pattern in args.patterns:
+        events = PATTERNS[pattern](args.keys, args.notes, bpm=args.bpm, seed=args.seed)
+        for path in args.paths:
+            if path == 'canvas':
+                if root is None:
+                    print(f'{pattern:>10} {path:>10}  skipped, no display')
+                    continue
+                path_args = (settings, events, root)
+            else:
+                path_args = (settings, events)
+            # the median of several runs, a single run's p99 varies too much to compare against
+            runs = [summarize(PATHS[path](*path_args)) for _ in range(args.repeats)]
+            result = {key: median(run[key] for run in runs) for key in runs[0]}
+            results[f'{args.keys}k/{pattern}/{path}'] = result
+            print(f"{pattern:>10} {path:>10} {result['events_per_s']:>12.0f} events/s "
+                  f"p50 {result['p50_us']:>8.1f}us p99 {result['p99_us']:>8.1f}us")
+    return results
+
+
+def compare(results, baselines, tolerance, p99_tolerance):
+    """
+    Returns the benchmarks that got slower than their baseline by more than `tolerance`,
+    or `p99_tolerance` for the p99 latency, which is noisier than the rate and the median.
+    """
+    regressions = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            continue
+        if result['events_per_s'] < baseline['events_per_s'] * (1 - tolerance):
+            regressions.append(f"{name}: {result['events_per_s']:.0f} events/s, "
+                               f"baseline {baseline['events_per_s']:.0f}")
+        for key, key_tolerance in (('p50_us', tolerance), ('p99_us', p99_tolerance)):
+            if result[key] > baseline[key] * (1 + key_tolerance):
+                regressions.append(f'{name}: {key} {result[key]:.1f}, baseline {baseline[key]:.1f}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmarks the detection, analysis and canvas paths')
+    parser.add_argument('--keys', type=int, default=4)
+    parser.add_argument('--notes', type=int, default=20000, help='notes per pattern')
+    parser.add_argument('--bpm', type=float, default=180)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--patterns', nargs='+', choices=list(PATTERNS), default=list(PATTERNS))
+    parser.add_argument('--paths', nargs='+', choices=list(PATHS), default=list(PATHS))
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file to compare against')
+    parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative slowdown reported as a regression')
+    parser.add_argument('--p99-tolerance', type=float, default=1,
+                        help='relative p99 latency increase reported as a regression')
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='runs per benchmark, the median of each result is reported')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    with virtual_display() as has_display:
+        root = None
+        if has_display and 'canvas' in args.paths:
+            try:
+                root = tk.Tk()
+            except tk.TclError as e:
+                logging.warning(f'canvas benchmarks need a display: {e}')
+        try:
+            results = run(args, root)
+        finally:
+            if root is not None:
+                root.destroy()
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baselines = json.load(file)
+    if args.save:
+        baselines.update(results)
+        with open(args.baseline, 'w') as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+        print(f"saved baselines to '{args.baseline}'")
+        return
+    regressions = compare(results, baselines, args.tolerance, args.p99_tolerance)
+    for regression in regressions:
+        print(f'regression: {regression}')
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import random
+
+from timing import NS_PER_MS, NS_PER_S
+
+
+def beat_ms(bpm, snap):
+    # `snap` notes per beat, e.g. 4 for 1/4 streams
+    return 60000 / bpm / snap
+
+
+def notes_to_events(notes, start_ns=NS_PER_S):
+    """
+    Turns (time_ms, keyindex, hold_ms) notes into time ordered (keyindex, is_down, timestamp) events.
+    Holds are cut short before the next press of the same key.
+    """
+    notes = sorted(notes)
+    next_press = {}
+    events = []
+    for time_ms, keyindex, hold_ms in reversed(notes):
+        if keyindex in next_press:
+            hold_ms = min(hold_ms, next_press[keyindex] - time_ms - 1)
+        next_press[keyindex] = time_ms
+        down = start_ns + round(time_ms * NS_PER_MS)
+        up = start_ns + round((time_ms + max(hold_ms, 1)) * NS_PER_MS)
+        events.append((down, 1, keyindex))
+        events.append((up, 0, keyindex))
+    # releases before presses at the same time
+    events.sort()
+    return [(keyindex, bool(is_down), timestamp) for timestamp, is_down, keyindex in events]
+
+
+def jittered(rng, time_ms, jitter_ms):
+    return time_ms + rng.gauss(0, jitter_ms) if jitter_ms else time_ms
+
+
+def stream(n_keys, n_notes, bpm=180, jitter_ms=4, hold_ratio=0.6, seed=0):
+    """
+    A roll through all keys in order in 1/4 notes, e.g. 1234 1234 in 4k.
+    """
+    rng = random.Random(seed)
+    interval = beat_ms(bpm, 4)
+    return notes_to_events([(jittered(rng, i * interval, jitter_ms), i % n_keys, interval * hold_ratio)
+                            for i in range(n_notes)])
+
+
+def jumptrill(n_keys, n_notes, bpm=180, jitter_ms=4, hold_ratio=0.6, seed=0):
+    """
+    Alternating jumps of the left and right half of the keys in 1/4 notes, e.g. [12][34] in 4k.
+    """
+    rng = random.Random(seed)
+    interval = beat_ms(bpm, 4)
+    halves = [range(n_keys // 2), range(n_keys // 2, n_keys)]
+    notes = []
+    i = 0
+    while len(notes) < n_notes:
+        for keyindex in halves[i % 2]:
+            notes.append((jittered(rng, i * interval, jitter_ms), keyindex, interval * hold_ratio))
+        i += 1
+    return notes_to_events(notes[:n_notes])
+
+
+def jack(n_keys, n_notes, bpm=180, jitter_ms=4, hold_ratio=0.5, jack_length=4, seed=0):
+    """
+    Every key pressed `jack_length` times in a row in 1/2 notes before moving to the next, e.g. 1111 2222.
+    """
+    rng = random.Random(seed)
+    interval = beat_ms(bpm, 2)
+    return notes_to_events([(jittered(rng, i * interval, jitter_ms), (i // jack_length) % n_keys,
+                             interval * hold_ratio) for i in range(n_notes)])
+
+
+def chord(n_keys, n_notes, bpm=180, jitter_ms=4, hold_ratio=0.5, seed=0):
+    """
+    All keys pressed together on every beat.
+    """
+    rng = random.Random(seed)
+    interval = beat_ms(bpm, 1)
+    return notes_to_events([(jittered(rng, (i // n_keys) * interval, jitter_ms), i % n_keys,
+                             interval * hold_ratio) for i in range(n_notes)])
+
+
+def noise(n_keys, n_notes, bpm=180, jitter_ms=15, seed=0):
+    """
+    Random keys with random holds of up to three notes, so most presses are mistakes.
+    """
+    rng = random.Random(seed)
+    interval = beat_ms(bpm, 4)
+    return notes_to_events([(jittered(rng, i * interval, jitter_ms), rng.randrange(n_keys),
+                             rng.uniform(0.2, 3) * interval) for i in range(n_notes)])
+
+
+PATTERNS = {
+    'stream': stream,
+    'jumptrill': jumptrill,
+    'jack': jack,
+    'chord': chord,
+    'noise': noise,
+}
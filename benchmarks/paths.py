@@ -0,0 +1,148 @@
+import contextlib
+import os
+import shutil
+import subprocess
+import time
+
+from detector import MistakeDetector, REPEAT, SKIP
+from rules import RuleTable
+from setting_handler import SettingHandler, SETTINGS_PATH
+from stats import TimingAnalysis
+
+
+def benchmark_settings(n_keys, settings_path=SETTINGS_PATH):
+    """
+    The settings in settings.yaml, resized to `n_keys` keys and without audio output.
+    """
+    settings = SettingHandler(settings_path)
+    if n_keys != settings.n_keys:
+        # the clear key stays the last bind
+        settings.bind_names = [f'key{k + 1}' for k in range(n_keys)] + settings.bind_names[-1:]
+        settings.bind_codes = list(range(n_keys)) + settings.bind_codes[-1:]
+        settings.colours = [settings.colours[k % len(settings.colours)] for k in range(n_keys)]
+        settings.aliases = [str(k + 1) for k in range(n_keys)]
+        settings.n_keys = n_keys
+        settings.rule_table = RuleTable(settings)
+    settings.sound_backend = 'null'
+    return settings
+
+
+def detect_all(settings, events):
+    # the detector results each event passes on to the other paths
+    detector = MistakeDetector(settings)
+    return [detector.feed(keyindex, is_down, timestamp) for keyindex, is_down, timestamp in events]
+
+
+def run_detection(settings, events):
+    """
+    The headless part of `App.handle_key` and `App.check_for_mistake`: detection and rule lookups.
+    Returns the latency of every event in ns.
+    """
+    detector = MistakeDetector(settings)
+    rule_table = settings.rule_table
+    clock = time.perf_counter_ns
+    latencies = []
+    for keyindex, is_down, timestamp in events:
+        start = clock()
+        mistakes = detector.feed(keyindex, is_down, timestamp)
+        if mistakes:
+            for record in mistakes:
+                rule_table.get_colours(record)
+                rule_table.get_sounds(record)
+        latencies.append(clock() - start)
+    return latencies
+
+
+def run_analysis(settings, events):
+    """
+    `App.press_analysis` and `App.release_analysis`, including the values passed to the bars.
+    """
+    results = detect_all(settings, events)
+    analysis = TimingAnalysis(settings.n_keys, settings.analysis_ewma_alpha,
+                              settings.analysis_outlier_ratio)
+    clock = time.perf_counter_ns
+    latencies = []
+    for (keyindex, is_down, timestamp), mistakes in zip(events, results):
+        if mistakes is None:
+            continue
+        start = clock()
+        if is_down:
+            counted = not any(record.type in (REPEAT, SKIP) for record in mistakes)
+            analysis.press(keyindex, counted, timestamp)
+        else:
+            analysis.release(keyindex, timestamp)
+        analysis.presses_ms()
+        analysis.releases_ms()
+        latencies.append(clock() - start)
+    return latencies
+
+
+def run_canvas(settings, events, root):
+    """
+    `CanvasFrame.insert_mistake`, which draws or scrolls the lines, and `CanvasFrame.draw_analysis`
+    on every analysed event, i.e. without coalescing redraws.
+    """
+    # tkinter is only needed for the canvas path
+    from canvas_frame import CanvasFrame
+    settings.analysis_enabled = True
+    settings.periphery_mode_enabled = False
+    results = detect_all(settings, events)
+    analysis = TimingAnalysis(settings.n_keys, settings.analysis_ewma_alpha,
+                              settings.analysis_outlier_ratio)
+    canvas_frame = CanvasFrame(settings, root, width=1, height=1)
+    canvas_frame.grid(row=0, column=0)
+    canvas_frame.refresh()
+    root.update()
+    clock = time.perf_counter_ns
+    latencies = []
+    for (keyindex, is_down, timestamp), mistakes in zip(events, results):
+        if mistakes is None:
+            continue
+        if is_down:
+            counted = not any(record.type in (REPEAT, SKIP) for record in mistakes)
+            analysis.press(keyindex, counted, timestamp)
+        else:
+            analysis.release(keyindex, timestamp)
+        presses_ms = analysis.presses_ms()
+        releases_ms = analysis.releases_ms()
+        start = clock()
+        for record in mistakes:
+            canvas_frame.insert_mistake(record)
+        canvas_frame.draw_analysis(presses_ms, releases_ms)
+        latencies.append(clock() - start)
+    root.update()
+    canvas_frame.stop_sound()
+    canvas_frame.destroy()
+    return latencies
+
+
+@contextlib.contextmanager
+def virtual_display():
+    """
+    Runs an Xvfb display if there is no display yet. Yields False if no display is available.
+    """
+    if os.environ.get('DISPLAY') or os.name == 'nt':
+        yield True
+        return
+    if not shutil.which('Xvfb'):
+        yield False
+        return
+    display = ':97'
+    server = subprocess.Popen(['Xvfb', display, '-screen', '0', '1280x1024x24'],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.environ['DISPLAY'] = display
+    try:
+        # wait for the server to accept connections
+        time.sleep(0.5)
+        yield server.poll() is None
+    finally:
+        del os.environ['DISPLAY']
+        server.terminate()
+        server.wait()
+
+
+PATHS = {
+    'detection': run_detection,
+    'analysis': run_analysis,
+    'canvas': run_canvas,
+}
@@ -1,73 +1,123 @@
 
-from apscheduler.schedulers.background import BackgroundScheduler
-from datetime import datetime, time, timedelta
+from datetime import datetime, date, time
 import logging
 import math
-from playsound import playsound
-import re
 import tkinter as tk
 import tkinter.ttk as ttk
 
-from canvas_line import CanvasBarline, CanvasDivider, CanvasScale
+from canvas_line import CanvasBarline, CanvasDivider, CanvasScale, CanvasTextline
+from canvas_line import text_metrics, FONT_FAMILY
+from diagnostics import diagnostics
 from mistake import Keylock, Skip
+from mistake_history import MistakeHistory
+from timeline import build_timeline, periodic_cycles, KEYLOCK, PRESSED
 from utils import modular_range
+import timing
+from timing import NS_PER_MS
 
 
 class CanvasFrame(ttk.Frame):
-    def __init__(self, settings, master, width, height):
+    FLASH_FRAME_MS = int(1000 / 30)
+
+    def __init__(self, settings, master, width, height, is_replay=False):
         super().__init__(master, width=width, height=height)
         self.settings = settings
+        self.is_replay = is_replay
         self.canvas = tk.Canvas(self, bg='white')
         self.canvas.grid(row=0, column=0, sticky='news')
         self.canvas.bind('<Enter>', self.bind_to_mousewheel)
         self.canvas.bind('<Leave>', self.unbind_to_mousewheel)
 
-        self.mistakes = []
+        self.mistakes = MistakeHistory(self.settings, self.settings.max_mistakes)
         self.n_lines, _ = self.calc_height()
         self.barlines = []
         self.textlines = []
         self.dividers = []
+        self.pale_colours = {}
+        self.analysis_values = ([0] * self.settings.n_keys, [0] * self.settings.n_keys)
+        self.analysis_after_id = None
+        self.canvas_width = None
+        self.canvas.bind('<Configure>', self.on_canvas_configure)
         self.y_scroll = 0
+        self.max_linewidth_key = None
+        self.max_linewidth = 0
         
         self.default_background_colour = 'white'
+        self.background_colour = None
+        self.flash_gradients = {}
+        self.flash_after_id = None
         if (self.settings.periphery_mode_enabled):
-            self.canvas.configure(background=self.settings.periphery_background_colour)
+            self.set_background_colour(self.settings.periphery_background_colour)
+
+        self.sound_engine = None
+        if self.settings.sound_enabled:
+            self.start_sound()
+
 
-        self.sound_scheduler = BackgroundScheduler()
-        self.sound_scheduler.start()
+    def start_sound(self):
+        filenames = [rule['filename'] for rule in self.settings.sound_rules]
+        if self.sound_engine is None:
+            # miniaudio is only loaded once sound is enabled
+            from sound import SoundEngine, create_backend
+            self.sound_engine = SoundEngine(filenames, create_backend(self.settings.sound_backend))
+        else:
+            self.sound_engine.load_clips(filenames)
+        for sounds in self.settings.rule_table.sounds.values():
+            self.sound_engine.get_premixed(sounds)
+
+
+    def stop_sound(self):
+        if self.sound_engine is not None:
+            self.sound_engine.close()
+            self.sound_engine = None
     
 
-    def insert_mistake(self, mistake):
-        self.mistakes.append(mistake)
+    def insert_mistake(self, record):
+        if self.mistakes.append(record):
+            # the oldest mistake was dropped, keep the view on the same mistakes
+            self.y_scroll = max(0, self.y_scroll - 1)
         if self.settings.periphery_mode_enabled:
-            self.draw_colour_mistake(mistake)
+            self.draw_colour_mistake(record)
         elif self.y_scroll == len(self.mistakes) - self.n_lines + len(self.barlines) - 1:
             self.scroll(+1)
         else:
             self.draw_lines()
         if self.settings.sound_enabled:
-            self.play_sounds(mistake)
+            self.play_sounds(record)
         
 
-    def draw_colour_mistake(self, mistake):
-        for rule in self.settings.periphery_rules:
-            if re.search(rule['regex'], mistake.get_mistake_text()):
-                self.flash_background(rule['colour'])
+    def draw_colour_mistake(self, record):
+        colours = self.settings.rule_table.get_colours(record)
+        for colour in colours:
+            self.flash_background(colour)
+        # replayed timestamps are from when the session was recorded
+        if colours and diagnostics.enabled and not self.is_replay:
+            diagnostics.record('flash', timing.now_ns() - record.timestamp)
 
 
     def draw_lines(self):
-        # deleting lines individually rather than with canvas.delete('all')
-        # as a workaround to avoid flickering when inserting mistakes.
-        # Apparently the mainloop keeps running when scroll() is called via insert_mistake()
-        # from the app object. This isn't an issue when it's called by an event handled 
-        # directly by the canvas_frame, e.g. when using the mouse wheel to scroll.
-        n_lines = max(0, self.n_lines - len(self.barlines))
-        lines = []
-        for i, mistake in enumerate(self.mistakes[self.y_scroll : self.y_scroll + n_lines]):
-            lines.append(mistake.create_canvas_line(self.canvas, len(self.barlines) + i))
-            if i < len(self.textlines):
-                self.textlines[i].delete()
-        self.textlines = lines
+        # canvas items are recycled rather than recreated: a line is only reconfigured
+        # if the mistake it displays changed, lines outside the view are deleted.
+        # This also avoids flickering when inserting mistakes, since nothing is 
+        # deleted and redrawn while the mainloop keeps running.
+        # Display objects are only built for lines whose mistake changed.
+        offset = len(self.barlines)
+        n_lines = max(0, self.n_lines - offset)
+        n_visible = max(0, min(n_lines, len(self.mistakes) - self.y_scroll))
+        for line in self.textlines[n_visible:]:
+            line.delete()
+        del self.textlines[n_visible:]
+        for i in range(n_visible):
+            index = self.y_scroll + i
+            sequence_number = self.mistakes.sequence_number(index)
+            if i == len(self.textlines):
+                line = CanvasTextline(self.settings, self.canvas, offset + i)
+                self.textlines.append(line)
+            else:
+                line = self.textlines[i]
+                line.place(offset + i)
+            if line.content != sequence_number:
+                line.set_texts(self.mistakes[index].get_fragments(), sequence_number)
 
 
     def draw_analysis(self, presses_ms, releases_ms):
@@ -76,135 +126,123 @@ class CanvasFrame(ttk.Frame):
         assert len(presses_ms) == n_keys
         assert len(releases_ms) == n_keys
         def pale(colour):
-            return self.interpolate_colour(colour, '#FFFFFF', 1/2)
-        lines = []
-        
-        # barline for all keys
-        lines.append(CanvasBarline(self.settings, self.canvas, presses_ms, colours, 0))
+            pale_colour = self.pale_colours.get(colour)
+            if pale_colour is None:
+                pale_colour = self.pale_colours[colour] = self.interpolate_colour(colour, '#FFFFFF', 1/2)
+            return pale_colour
+        n_rows = self.settings.analysis_release_rows
+        # enough cycles for the release rows to repeat, 1 whenever the keys divide evenly into the rows
+        n_cycles = periodic_cycles(n_keys, n_rows)
 
-        # barline for even keys with releases
-        values = []
-        line_colours = []
-        if n_keys % 2 == 0:
-            keylock_overlap = max(0, releases_ms[-2] - presses_ms[-2] - presses_ms[-1])
-        else:
-            keylock_overlap = max(0, releases_ms[-1] -  presses_ms[-1])
-        if keylock_overlap:
-            # wrap around keylock
-            values.append(keylock_overlap)
-            line_colours.append('black')
-        for i in range(0, n_keys, 2):
-            pair_press_ms = presses_ms[i] + presses_ms[(i + 1) % n_keys]
-            new_keylock = max(0, releases_ms[i] - pair_press_ms)
-            # pressed period
-            values.append(releases_ms[i] - keylock_overlap - new_keylock)
-            line_colours.append(colours[i])
-            if new_keylock:
-                # keylock
-                values.append(new_keylock)
-                line_colours.append('black')
-            else:
-                # released period
-                values.append(pair_press_ms - releases_ms[i])
-                line_colours.append(pale(colours[i]))
-            keylock_overlap = new_keylock
-        lines.append(CanvasBarline(self.settings, self.canvas, values, line_colours, 1))
-        
-        # barline for odd keys with releases
-        values = []
-        line_colours = []
-        if n_keys % 2 == 0:
-            overshoot_i = (-1) % n_keys
-            keylock_overlap = max(0, releases_ms[-1] - presses_ms[-1] - presses_ms[0])
-        else:
-            overshoot_i = (-2) % n_keys
-            keylock_overlap = max(0, releases_ms[-2] - sum(presses_ms[-2:]) - presses_ms[0])
-        press_overshoot = max(0, releases_ms[overshoot_i] - presses_ms[overshoot_i])
-        if press_overshoot:
-            # wrap around part of pressed period
-            values.append(press_overshoot - keylock_overlap)
-            line_colours.append(colours[overshoot_i])
-            if keylock_overlap:
-                # wrap around keylock
-                values.append(keylock_overlap)
-                line_colours.append('black')
-            else:
-                # wrap around part of released period
-                values.append(presses_ms[0] - press_overshoot)
-                line_colours.append(pale(colours[overshoot_i]))
-        else:
-            # wrap around part of released period
-            values.append(presses_ms[0])
-            line_colours.append(pale(colours[overshoot_i]))
-        for i in range(1, overshoot_i, 2):
-            pair_press_ms = presses_ms[i] + presses_ms[(i + 1) % n_keys]
-            new_keylock = max(0, releases_ms[i] - pair_press_ms)
-            # pressed period
-            values.append(releases_ms[i] - keylock_overlap - new_keylock)
-            line_colours.append(colours[i])
-            if new_keylock:
-                # keylock
-                values.append(new_keylock)
+        # barline for all keys
+        bars = [(list(presses_ms) * n_cycles, colours * n_cycles)]
+        # a barline per row of releases, presses are dealt to the rows in turn
+        bars.extend(([], []) for _ in range(n_rows))
+        for segment in build_timeline(presses_ms, releases_ms, n_rows, n_cycles):
+            values, line_colours = bars[segment.row + 1]
+            values.append(segment.end - segment.start)
+            if segment.kind == KEYLOCK:
                 line_colours.append('black')
+            elif segment.kind == PRESSED:
+                line_colours.append(colours[segment.keyindex])
             else:
-                # released period
-                values.append(pair_press_ms - releases_ms[i])
-                line_colours.append(pale(colours[i]))
-            keylock_overlap = new_keylock
-        if releases_ms[overshoot_i] > presses_ms[overshoot_i]:
-            # part of pressed period
-            values.append(presses_ms[overshoot_i] - keylock_overlap)
-            line_colours.append(colours[overshoot_i])
+                line_colours.append(pale(colours[segment.keyindex]))
+
+        # existing rectangles are only moved and recoloured
+        if len(self.barlines) == len(bars):
+            for barline, (values, line_colours) in zip(self.barlines, bars):
+                barline.update(values, line_colours)
         else:
-            # pressed period
-            values.append(releases_ms[overshoot_i] - keylock_overlap)
-            line_colours.append(colours[overshoot_i])
-            # part of released period
-            values.append(presses_ms[overshoot_i] - releases_ms[overshoot_i])
-            line_colours.append(pale(colours[overshoot_i]))
-        lines.append(CanvasBarline(self.settings, self.canvas, values, line_colours, 2))
-
-        for barline in self.barlines:
-            barline.delete()
-        self.barlines = lines
-
-        # dividers
+            for barline in self.barlines:
+                barline.delete()
+            self.barlines = [CanvasBarline(self.settings, self.canvas, values, line_colours, y)
+                             for y, (values, line_colours) in enumerate(bars)]
+        if not self.dividers:
+            self.draw_dividers()
+
+
+    def draw_dividers(self):
+        n_keys = self.settings.n_keys
         stroke = self.settings.divider_stroke
         mark_height = self.settings.scale_mark_prominence
         dividers = []
         dividers.append(CanvasDivider(self.settings, self.canvas, 'black', stroke, 0))
-        scale = [n / n_keys for n in range(1, n_keys + 1)]
+        n_presses = n_keys * periodic_cycles(n_keys, self.settings.analysis_release_rows)
+        scale = [n / n_presses for n in range(1, n_presses + 1)]
         dividers.append(CanvasScale(
             self.settings, self.canvas, scale, 'black', stroke, mark_height, 0))
         dividers.append(CanvasDivider(self.settings, self.canvas, 'black', stroke, 1))
-        dividers.append(CanvasDivider(self.settings, self.canvas, 'black', stroke, 3))
+        dividers.append(CanvasDivider(
+            self.settings, self.canvas, 'black', stroke, 1 + self.settings.analysis_release_rows))
         for divider in self.dividers:
             divider.delete()
         self.dividers = dividers
 
 
+    def update_analysis(self, presses_ms, releases_ms):
+        # redraws are coalesced, so that the bars are drawn at most once per frame
+        self.analysis_values = (presses_ms, releases_ms)
+        if self.analysis_after_id is None:
+            frame_ms = max(1, int(1000 / self.settings.analysis_max_fps))
+            self.analysis_after_id = self.after(frame_ms, self.redraw_analysis)
 
-    def flash_background(self, hex_colour):
-        self.current_flash_id = datetime.now().timestamp()
-        flash_id = self.current_flash_id
 
-        original_colour = self.settings.periphery_background_colour
+    def redraw_analysis(self):
+        self.analysis_after_id = None
+        # bars are only created by refresh, which also makes room for them
+        if self.settings.analysis_enabled and self.barlines:
+            start = diagnostics.enabled and timing.now_ns()
+            self.draw_analysis(*self.analysis_values)
+            if start:
+                diagnostics.record('analysis', timing.now_ns() - start)
+
+
+    def on_canvas_configure(self, event):
+        if event.width == self.canvas_width:
+            return
+        self.canvas_width = event.width
+        # dividers and scale marks only change on resize
+        for divider in self.dividers:
+            divider.delete()
+        self.dividers = []
+        if self.barlines:
+            self.draw_analysis(*self.analysis_values)
 
-        decay = self.settings.periphery_decay_ms
-        fps = 30
 
-        delay = int(1000 / fps)
-        steps = int(decay / delay)
+    def flash_background(self, hex_colour):
+        # a new flash replaces the current one, a single ticker animates whichever is active
+        self.flash_gradient = self.get_flash_gradient(hex_colour)
+        self.flash_start = timing.now_ns()
+        if self.flash_after_id is None:
+            self.flash_tick()
+        else:
+            self.set_background_colour(self.flash_gradient[0])
 
-        for step in range(steps + 1):
-            fraction = step / steps
-            colour = self.interpolate_colour(hex_colour, original_colour, fraction)
 
-            def update_colour(c=colour, fid=flash_id):
-                if self.current_flash_id == fid:
-                    self.canvas.configure(background=c)
+    def flash_tick(self):
+        if not self.settings.periphery_mode_enabled:
+            self.flash_after_id = None
+            return
+        # frames are picked by elapsed time, so late ticks skip ahead instead of stretching the decay
+        step = (timing.now_ns() - self.flash_start) // (self.FLASH_FRAME_MS * NS_PER_MS)
+        step = min(step, len(self.flash_gradient) - 1)
+        self.set_background_colour(self.flash_gradient[step])
+        if step == len(self.flash_gradient) - 1:
+            self.flash_after_id = None
+            return
+        self.flash_after_id = self.after(self.FLASH_FRAME_MS, self.flash_tick)
 
-            self.after(step * delay, update_colour)
+
+    def get_flash_gradient(self, hex_colour):
+        original_colour = self.settings.periphery_background_colour
+        steps = int(self.settings.periphery_decay_ms / self.FLASH_FRAME_MS)
+        key = (hex_colour, original_colour, steps)
+        gradient = self.flash_gradients.get(key)
+        if gradient is None:
+            gradient = self.flash_gradients[key] = [
+                self.interpolate_colour(hex_colour, original_colour, step / steps) 
+                for step in range(steps)] + [original_colour]
+        return gradient
 
 
     def interpolate_colour(self, start, end, fraction):
@@ -214,12 +252,8 @@ class CanvasFrame(ttk.Frame):
         return '#{:02x}{:02x}{:02x}'.format(*interp_rgb)
             
 
-    def play_sounds(self, mistake):
-        for rule in self.settings.sound_rules:
-            if re.search(rule['regex'], mistake.get_mistake_text()):
-                run_date = datetime.now() + timedelta(milliseconds=rule['delay_ms'])
-                self.sound_scheduler.add_job(playsound, 'date', run_date=run_date, 
-                                             args=(f"sounds/{rule['filename']}",))
+    def play_sounds(self, record):
+        self.sound_engine.play(self.settings.rule_table.get_sounds(record))
 
 
     def bind_to_mousewheel(self, event):
@@ -251,12 +285,21 @@ class CanvasFrame(ttk.Frame):
 
     def scroll(self, line_delta):
         max_y_scroll = max(0, len(self.mistakes) - len(self.textlines))
-        self.y_scroll = min(max_y_scroll, max(0, self.y_scroll + line_delta))
+        y_scroll = min(max_y_scroll, max(0, self.y_scroll + line_delta))
+        line_delta = y_scroll - self.y_scroll
+        self.y_scroll = y_scroll
+        if 0 < abs(line_delta) < len(self.textlines):
+            # shift all lines with a single call, then rotate the lines that left the view
+            # to the other end, where draw_lines reuses them for the newly visible mistakes
+            self.canvas.move(CanvasTextline.TAG, 0, -line_delta * self.textlines[0].height)
+            for line in self.textlines:
+                line.shifted(-line_delta)
+            self.textlines = self.textlines[line_delta:] + self.textlines[:line_delta]
         self.draw_lines()
 
 
     def clear(self):
-        self.mistakes = []
+        self.mistakes.clear()
         self.y_scroll = 0
         self.refresh()
             
@@ -268,6 +311,10 @@ class CanvasFrame(ttk.Frame):
         self.configure(width=width, height=height)
         self.canvas.delete('all')
         self.textlines = []
+        self.barlines = []
+        self.dividers = []
+        if self.settings.analysis_enabled:
+            self.draw_analysis(*self.analysis_values)
         if self.settings.periphery_mode_enabled:
             self.set_background_colour(self.settings.periphery_background_colour)
         else:
@@ -283,22 +330,30 @@ class CanvasFrame(ttk.Frame):
 
 
     def get_max_linewidth(self):
-        canvas = tk.Canvas(self)
+        # the widest line only depends on these, so it's computed once per combination
+        key = (tuple(self.settings.aliases), tuple(self.settings.bind_names),
+               self.settings.key_display_method, self.settings.font_size, self.settings.n_keys)
+        if key == self.max_linewidth_key:
+            return self.max_linewidth
+        font_size = self.settings.font_size
         # possible longest line widths
         widths = []
-        widest_time = time(hour=0, minute=0, second=0)
+        widest_time = timing.from_datetime(datetime.combine(date.today(), time()))
         for i in range(self.settings.n_keys):
             # keylocked
             keylock = Keylock(self.settings, [i, (i+2) % self.settings.n_keys], widest_time)
-            line = keylock.create_canvas_line(canvas, 0)
-            widths.append(line.width)
             # skipped
             skip = Skip(self.settings, [j for j in modular_range(self.settings.n_keys, i, i-2)], widest_time)
-            line = skip.create_canvas_line(canvas, 0)
-            widths.append(line.width)
+            for mistake in (keylock, skip):
+                widths.append(sum(text_metrics.measure(text, FONT_FAMILY, font_size)
+                                  for text, _ in mistake.get_fragments()))
         logging.debug(f'possible max line widths: {widths}')
-        return max(widths)
+        self.max_linewidth_key = key
+        self.max_linewidth = max(widths)
+        return self.max_linewidth
     
 
     def set_background_colour(self, hex_colour):
-        self.canvas.configure(background=hex_colour)
\ No newline at end of file
+        if hex_colour != self.background_colour:
+            self.background_colour = hex_colour
+            self.canvas.configure(background=hex_colour)
\ No newline at end of file
@@ -1,5 +1,54 @@
 
 
+import tkinter.font as tkfont
+
+
+FONT_FAMILY = 'tkDefaultFont'
+
+
+class TextMetrics():
+    """
+    Text widths and line heights, cached by (text, font family, font size). 
+    Lines are laid out from these instead of querying the canvas for bounding boxes.
+    """
+    def __init__(self):
+        self.fonts = {}
+        self.widths = {}
+        self.linespaces = {}
+
+
+    def get_font(self, family, size):
+        font = self.fonts.get((family, size))
+        if font is None:
+            font = self.fonts[(family, size)] = tkfont.Font(font=f'{family} {size}')
+        return font
+
+
+    def measure(self, text, family, size):
+        key = (text, family, size)
+        width = self.widths.get(key)
+        if width is None:
+            width = self.widths[key] = self.get_font(family, size).measure(text)
+        return width
+
+
+    def linespace(self, family, size):
+        key = (family, size)
+        linespace = self.linespaces.get(key)
+        if linespace is None:
+            linespace = self.linespaces[key] = self.get_font(family, size).metrics('linespace')
+        return linespace
+
+
+    def clear(self):
+        self.fonts = {}
+        self.widths = {}
+        self.linespaces = {}
+
+
+text_metrics = TextMetrics()
+
+
 class CanvasLine():
     def __init__(self, settings, canvas, y):
         self.settings = settings
@@ -14,24 +63,71 @@ class CanvasLine():
 
 
 class CanvasTextline(CanvasLine):
+    # tag shared by the items of all textlines, so that they can be shifted with a single call
+    TAG = 'textline'
+
     def __init__(self, settings, canvas, y):
         super().__init__(settings, canvas, y)
         self.texts = []
+        self.xs = []
         self.width = 0
         self.x_px = self.settings.relative_pad_left * self.settings.font_size
+        # whatever is currently displayed, lets owners skip redundant updates
+        self.content = None
         
         
     def add_text(self, text, fill='black'):
         new_text = self.canvas.create_text(self.x_px + self.width, self.y_px, 
                                            text=text, anchor='nw', fill=fill, 
-                                           font=f'tkDefaultFont {self.settings.font_size}')
+                                           font=f'{FONT_FAMILY} {self.settings.font_size}',
+                                           tags=self.TAG)
         self.texts.append(new_text)
-        bbox = self.canvas.bbox(new_text)
-        self.width += bbox[2] - bbox[0]
+        self.xs.append(self.x_px + self.width)
+        self.width += text_metrics.measure(text, FONT_FAMILY, self.settings.font_size)
+
+
+    def set_texts(self, fragments, content=None):
+        """
+        Displays `fragments`, a list of (text, fill) tuples, 
+        reusing the existing canvas items of this line where possible.
+        """
+        self.content = content
+        n_reused = min(len(fragments), len(self.texts))
+        for text in self.texts[len(fragments):]:
+            self.canvas.delete(text)
+        del self.texts[n_reused:]
+        del self.xs[n_reused:]
+        self.width = 0
+        for i, (text, fill) in enumerate(fragments):
+            if i >= n_reused:
+                self.add_text(text, fill)
+                continue
+            item = self.texts[i]
+            x_px = self.x_px + self.width
+            self.canvas.itemconfigure(item, text=text, fill=fill)
+            if x_px != self.xs[i]:
+                self.canvas.coords(item, x_px, self.y_px)
+                self.xs[i] = x_px
+            self.width += text_metrics.measure(text, FONT_FAMILY, self.settings.font_size)
+
+
+    def place(self, y):
+        if y == self.y:
+            return
+        dy_px = (y - self.y) * self.height
+        for text in self.texts:
+            self.canvas.move(text, 0, dy_px)
+        self.shifted(y - self.y)
+
+
+    def shifted(self, line_delta):
+        # bookkeeping after the items were moved by the owner, e.g. via the shared tag
+        self.y += line_delta
+        self.y_px = self.y * self.height
         
 
     def get_height(self):
-        return max([self.canvas.bbox(text)[3] - self.canvas.bbox(text)[1] for text in self.texts])
+        return text_metrics.linespace(FONT_FAMILY, self.settings.font_size)
 
 
     def delete(self):
@@ -42,23 +138,42 @@ class CanvasTextline(CanvasLine):
 class CanvasBarline(CanvasLine):
     def __init__(self, settings, canvas, values, colours, y):
         super().__init__(settings, canvas, y)
+        self.rects = []
+        self.colours = []
+        self.update(values, colours)
+
+
+    def update(self, values, colours):
+        """
+        Redraws the bar, moving and recolouring the existing rectangles where possible.
+        """
         if len(values) != len(colours):
             raise ValueError('the number of values and colours must be equal')
         if any([value < 0 for value in values]):
             raise ValueError('barline values must be positive')
         self.values = values
-        self.colours = colours
         
-        self.rects = []
+        for rect in self.rects[len(values):]:
+            self.canvas.delete(rect)
+        del self.rects[len(values):]
+        del self.colours[len(values):]
         total = sum(values)
         if total == 0:
             values = [1] * len(values)
             total = len(values)
+        canvas_width = self.canvas.winfo_width()
         x_px = 0
-        for value, colour in zip(values, colours):
-            width = canvas.winfo_width() * value / total
-            self.rects.append(self.canvas.create_rectangle(
-                x_px, self.y_px, x_px + width, self.y_px + self.height, fill=colour, width=0))
+        for i, (value, colour) in enumerate(zip(values, colours)):
+            width = canvas_width * value / total
+            coords = (x_px, self.y_px, x_px + width, self.y_px + self.height)
+            if i < len(self.rects):
+                self.canvas.coords(self.rects[i], *coords)
+                if colour != self.colours[i]:
+                    self.canvas.itemconfigure(self.rects[i], fill=colour)
+                    self.colours[i] = colour
+            else:
+                self.rects.append(self.canvas.create_rectangle(*coords, fill=colour, width=0))
+                self.colours.append(colour)
             x_px += width
     
 
@@ -0,0 +1,188 @@
+from itertools import permutations
+import logging
+from queue import SimpleQueue, Empty
+import sqlite3
+import threading
+import time
+
+import timing
+from detector import MistakeRecord
+from session import encode_code
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    start_time INTEGER NOT NULL,
+    n_keys INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    session_id INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    code INTEGER NOT NULL,
+    keyindex INTEGER NOT NULL,
+    is_down INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mistakes (
+    session_id INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    type INTEGER NOT NULL,
+    keys TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_time ON events (time);
+CREATE INDEX IF NOT EXISTS mistakes_time ON mistakes (time);
+CREATE INDEX IF NOT EXISTS mistakes_type_keys_time ON mistakes (type, keys, time);
+CREATE INDEX IF NOT EXISTS mistakes_keys_time ON mistakes (keys, time);
+'''
+
+# queued rows are tagged with the table they go into
+EVENT_ROW = 0
+MISTAKE_ROW = 1
+
+
+def encode_keys(keyindices):
+    return ','.join(str(keyindex) for keyindex in keyindices)
+
+
+def decode_keys(keys):
+    return tuple(int(keyindex) for keyindex in keys.split(','))
+
+
+def connect(path):
+    connection = sqlite3.connect(path)
+    # readers don't block the writer and vice versa
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class MistakeDatabase():
+    """
+    Stores every mistake and raw key event in an SQLite database across sessions.
+    `add_event` and `add_mistake` only put rows on a queue, a background thread writes them
+    in batches of up to `batch_size` rows per transaction, at least every `flush_ms`.
+    Times are stored as wall clock ns since the epoch.
+    """
+    def __init__(self, path, n_keys, batch_size=1000, flush_ms=500):
+        self.path = path
+        self.n_keys = n_keys
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.rows = SimpleQueue()
+        self.n_written = 0
+        self.closing = False
+        # the connection is opened by the writer thread, sqlite connections are tied to their thread
+        self.ready = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        if self.error:
+            raise self.error
+        logging.info(f"writing mistakes and events to '{path}'")
+
+
+    def add_event(self, code, keyindex, is_down, timestamp):
+        self.rows.put((EVENT_ROW, timing.to_wall_ns(timestamp), encode_code(code), keyindex, int(is_down)))
+
+
+    def add_mistake(self, record):
+        self.rows.put((MISTAKE_ROW, timing.to_wall_ns(record.timestamp), record.type,
+                       encode_keys(record.keyindices)))
+
+
+    def run(self):
+        try:
+            connection = connect(self.path)
+            with connection:
+                cursor = connection.execute('INSERT INTO sessions (start_time, n_keys) VALUES (?, ?)',
+                                            (time.time_ns(), self.n_keys))
+            session_id = cursor.lastrowid
+        except Exception as e:
+            self.error = e
+            self.ready.set()
+            return
+        self.ready.set()
+        while not self.closing:
+            batch = self.next_batch()
+            if batch:
+                self.write(connection, session_id, batch)
+        connection.close()
+
+
+    def next_batch(self):
+        # blocks until a row arrives, then collects what arrives until the batch is full or due
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            timeout = self.flush_ms / 1000 if deadline is None else deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                row = self.rows.get(timeout=timeout)
+            except Empty:
+                break
+            if row is None:
+                self.closing = True
+                break
+            batch.append(row)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_ms / 1000
+        return batch
+
+
+    def write(self, connection, session_id, batch):
+        events = [(session_id,) + row[1:] for row in batch if row[0] == EVENT_ROW]
+        mistakes = [(session_id,) + row[1:] for row in batch if row[0] == MISTAKE_ROW]
+        try:
+            with connection:
+                connection.executemany(
+                    'INSERT INTO events (session_id, time, code, keyindex, is_down) VALUES (?, ?, ?, ?, ?)',
+                    events)
+                connection.executemany(
+                    'INSERT INTO mistakes (session_id, time, type, keys) VALUES (?, ?, ?, ?)',
+                    mistakes)
+            self.n_written += len(batch)
+        except sqlite3.Error as e:
+            logging.error(f'failed to write {len(batch)} rows to the database: {e}')
+
+
+    def close(self):
+        self.rows.put(None)
+        self.thread.join()
+        logging.info(f"wrote {self.n_written} rows to '{self.path}'")
+
+
+def query_mistakes(path, mistake_type=None, keyindices=None, since=None, until=None):
+    """
+    Returns the stored `MistakeRecord`s matching all given filters, ordered by time.
+    `keyindices` matches records of those keys in any order, e.g. keylocks stored as (2, 0) for (0, 2).
+    `since` and `until` are datetimes, record timestamps are converted back to the monotonic clock.
+    e.g. keylocks of keys 1 and 3 in the last 30 days:
+    query_mistakes(path, KEYLOCK, (0, 2), datetime.now() - timedelta(days=30))
+    """
+    conditions = []
+    parameters = []
+    if mistake_type is not None:
+        conditions.append('type = ?')
+        parameters.append(mistake_type)
+    if keyindices is not None:
+        orders = {encode_keys(order) for order in permutations(keyindices)}
+        conditions.append(f"keys IN ({', '.join('?' * len(orders))})")
+        parameters.extend(orders)
+    if since is not None:
+        conditions.append('time >= ?')
+        parameters.append(timing.to_wall_ns(timing.from_datetime(since)))
+    if until is not None:
+        conditions.append('time < ?')
+        parameters.append(timing.to_wall_ns(timing.from_datetime(until)))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    connection = connect(path)
+    try:
+        rows = connection.execute(
+            f'SELECT type, keys, time FROM mistakes {where} ORDER BY time', parameters).fetchall()
+    finally:
+        connection.close()
+    return [MistakeRecord(type_code, decode_keys(keys), timing.from_wall_ns(wall_ns))
+            for type_code, keys, wall_ns in rows]
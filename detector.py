@@ -0,0 +1,111 @@
+from collections import namedtuple
+
+import timing
+from timing import NS_PER_S
+from utils import modular_range
+
+
+# mistake type codes
+KEYLOCK = 0
+REPEAT = 1
+SKIP = 2
+
+MistakeRecord = namedtuple('MistakeRecord', ['type', 'keyindices', 'timestamp'])
+
+
+class MistakeDetector():
+    """
+    Keylock, repeat and skip detection without any GUI dependencies.
+    Events are (keyindex, is_down, timestamp) with monotonic ns timestamps,
+    events without a timestamp are stamped with `clock`.
+    """
+    def __init__(self, settings, clock=timing.now_ns):
+        self.settings = settings
+        self.clock = clock
+        self.reset()
+
+
+    def reset(self):
+        n_keys = self.n_keys = self.settings.n_keys
+        self.pressed = [False] * n_keys
+        self.n_pressed = 0
+        self.last_keyindex = None
+        self.full_release_time = None
+        # lookup tables so that a press only costs a few list accesses
+        self.two_back = [(i - 2) % n_keys for i in range(n_keys)]
+        self.skipped = [[tuple(modular_range(n_keys, last + 1, i)) for i in range(n_keys)]
+                        for last in range(n_keys)]
+
+
+    def feed(self, keyindex, is_down, timestamp=None):
+        """
+        Returns the mistakes triggered by the event as a tuple of `MistakeRecord`s,
+        or None if the event is a press that is ignored.
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+        pressed = self.pressed
+
+        # releases do not trigger mistakes
+        if not is_down:
+            if pressed[keyindex]:
+                pressed[keyindex] = False
+                self.n_pressed -= 1
+            if not self.n_pressed:
+                self.full_release_time = timestamp
+            return ()
+        # repeated keydown events due to holding are not registered
+        if pressed[keyindex]:
+            return None
+        last_keyindex = self.last_keyindex
+        mistakes = ()
+        # if all keys have been released for a while, no mistakes are triggered
+        if self.full_release_time is not None:
+            release_ns = timestamp - self.full_release_time
+            self.full_release_time = None
+            settings = self.settings
+            if settings.do_full_release and release_ns >= settings.release_seconds * NS_PER_S:
+                mistakes = None
+        if mistakes is not None:
+            two_back = self.two_back[keyindex]
+            if pressed[two_back]:
+                mistakes += (MistakeRecord(KEYLOCK, (two_back, keyindex), timestamp),)
+            if keyindex == last_keyindex:
+                mistakes += (MistakeRecord(REPEAT, (keyindex,), timestamp),)
+            elif last_keyindex is not None:
+                skipped = self.skipped[last_keyindex][keyindex]
+                if skipped:
+                    mistakes += (MistakeRecord(SKIP, skipped, timestamp),)
+        pressed[keyindex] = True
+        self.n_pressed += 1
+        self.last_keyindex = keyindex
+        return mistakes
+
+
+    def detect(self, events):
+        """
+        Runs a stream of (keyindex, is_down, timestamp) events through the detector
+        and yields every mistake found.
+        """
+        feed = self.feed
+        for keyindex, is_down, timestamp in events:
+            mistakes = feed(keyindex, is_down, timestamp)
+            if mistakes:
+                yield from mistakes
+
+
+def possible_mistakes(n_keys):
+    """
+    All (type, keyindices) combinations the detector can report for `n_keys` keys.
+    """
+    mistakes = []
+    for keyindex in range(n_keys):
+        two_back = (keyindex - 2) % n_keys
+        if two_back != keyindex:
+            mistakes.append((KEYLOCK, (two_back, keyindex)))
+        mistakes.append((REPEAT, (keyindex,)))
+        for last_keyindex in range(n_keys):
+            skipped = tuple(modular_range(n_keys, last_keyindex + 1, keyindex))
+            if last_keyindex != keyindex and skipped:
+                mistakes.append((SKIP, skipped))
+    return mistakes
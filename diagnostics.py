@@ -0,0 +1,103 @@
+from datetime import datetime
+import logging
+
+
+# bucket i counts latencies below 2**i µs, the last bucket also everything above
+N_BUCKETS = 21
+
+# stage -> label, in pipeline order
+STAGES = {
+    'hook': 'input hook to handler',
+    'detect': 'MistakeDetector.feed',
+    'insert': 'insert_mistake / draw_lines',
+    'analysis': 'draw_analysis',
+    'flash': 'input hook to periphery flash',
+    'sound': 'sound trigger to first sample',
+}
+
+
+class LatencyHistogram():
+    """
+    Latencies counted in fixed power of two buckets, recording is O(1) and allocation free.
+    """
+    def __init__(self):
+        self.counts = [0] * N_BUCKETS
+        self.n = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+
+    def record(self, latency_ns):
+        i = (latency_ns // 1000).bit_length()
+        self.counts[i if i < N_BUCKETS else N_BUCKETS - 1] += 1
+        self.n += 1
+        self.total_ns += latency_ns
+        if latency_ns > self.max_ns:
+            self.max_ns = latency_ns
+
+
+    def percentile_us(self, p):
+        # upper bound of the bucket containing the percentile
+        target = p / 100 * self.n
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if count and cumulative >= target:
+                return min(2 ** i, round(self.max_ns / 1000))
+        return 0
+
+
+    def mean_us(self):
+        return self.total_ns / self.n / 1000 if self.n else 0
+
+
+class Diagnostics():
+    """
+    Per-stage latency histograms of the input to display and sound pipeline.
+    Callers check `enabled` before taking timestamps, so it costs a single attribute lookup when off.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.clear()
+
+
+    def clear(self):
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+
+
+    def record(self, stage, latency_ns):
+        self.histograms[stage].record(latency_ns)
+
+
+    def report(self):
+        lines = [f"{'stage':<32}{'n':>9}{'mean':>10}{'p50':>10}{'p99':>10}{'max':>10}  (µs)"]
+        for stage, label in STAGES.items():
+            histogram = self.histograms[stage]
+            if not histogram.n:
+                lines.append(f'{label:<32}{0:>9}')
+                continue
+            lines.append(
+                f'{label:<32}{histogram.n:>9}{histogram.mean_us():>10.0f}'
+                f'{histogram.percentile_us(50):>10}{histogram.percentile_us(99):>10}'
+                f'{histogram.max_ns / 1000:>10.0f}')
+        return '\n'.join(lines)
+
+
+    def dump(self, path):
+        """
+        Appends the report and the raw bucket counts to `path`.
+        """
+        bucket_names = ' '.join(f'<{2 ** i}' for i in range(N_BUCKETS))
+        try:
+            with open(path, 'a') as file:
+                file.write(f'{datetime.now():%Y-%m-%d %H:%M:%S}\n{self.report()}\n')
+                file.write(f'buckets (µs): {bucket_names}\n')
+                for stage, histogram in self.histograms.items():
+                    file.write(f"{stage}: {' '.join(str(count) for count in histogram.counts)}\n")
+                file.write('\n')
+            logging.info(f"dumped latency histograms to '{path}'")
+        except OSError as e:
+            logging.error(f"failed to dump latency histograms: {e}")
+
+
+diagnostics = Diagnostics()
@@ -0,0 +1,150 @@
+import fcntl
+import glob
+import logging
+import os
+import re
+import selectors
+import struct
+import threading
+import time
+
+from timing import NS_PER_S
+from utils import KeyInput
+
+
+# struct input_event: timeval seconds and microseconds, type, code, value
+EVENT = struct.Struct('llHHi')
+# offset of type, code and value within an event
+TAIL_OFFSET = EVENT.size - 8
+EV_KEY = 1
+# _IOW('E', 0xa0, int), makes the kernel stamp events with the given clock
+EVIOCSCLOCKID = 0x400445a0
+# evdev codes of the mouse buttons in `MOUSE_BUTTON_NAMES`, keyboard scan codes are evdev codes already
+BUTTON_CODES = {'left': 0x110, 'right': 0x111, 'middle': 0x112, 'x': 0x113, 'x2': 0x114}
+
+
+class EvdevFilter():
+    """
+    Picks the key down and key up events of bound codes out of raw evdev bytes.
+    A regex scans the bytes in C, so only events of bound keys are unpacked into Python objects,
+    key repeats, mouse motion and unbound keys never leave the regex engine.
+    """
+    def __init__(self, bind_codes):
+        self.set_binds(bind_codes)
+
+
+    def set_binds(self, bind_codes):
+        binds = {}
+        for keyindex, code in enumerate(bind_codes):
+            if code:
+                binds[BUTTON_CODES.get(code, code)] = (code, keyindex)
+        pattern = None
+        if binds:
+            codes = b'|'.join(re.escape(struct.pack('H', evdev_code)) for evdev_code in binds)
+            values = b'|'.join(re.escape(struct.pack('i', value)) for value in (0, 1))
+            # matches the type, code and value at the end of an event, the literal prefix lets
+            # the regex engine skip ahead quickly. A misaligned match can't hide an aligned one,
+            # since the microseconds before it are below 2**20 and can't contain the type
+            pattern = re.compile(b'%s(?:%s)(?:%s)' % (re.escape(struct.pack('H', EV_KEY)), codes, values))
+        # swapped at once, the reader thread may be filtering at the same time
+        self.binds, self.pattern = binds, pattern
+
+
+    def feed(self, data):
+        """
+        Returns (timestamp, `KeyInput`) pairs for the bound key events in whole input_events `data`.
+        """
+        binds, pattern = self.binds, self.pattern
+        if pattern is None:
+            return []
+        inputs = []
+        for match in pattern.finditer(data):
+            offset = match.start() - TAIL_OFFSET
+            if offset % EVENT.size:
+                continue
+            seconds, microseconds, _, evdev_code, value = EVENT.unpack_from(data, offset)
+            code, keyindex = binds[evdev_code]
+            inputs.append((seconds * NS_PER_S + microseconds * 1000, KeyInput(code, keyindex, value == 1)))
+        return inputs
+
+
+class EvdevReader():
+    """
+    Reads key events straight from /dev/input/event* on a background thread and puts them on
+    `event_queue` with the kernel's timestamps. The devices are switched to CLOCK_MONOTONIC,
+    the clock `timing.now_ns` uses. Reading the devices requires root or the input group.
+    """
+    def __init__(self, event_queue, bind_codes, paths=None):
+        self.event_queue = event_queue
+        self.filter = EvdevFilter(bind_codes)
+        self.selector = selectors.DefaultSelector()
+        for path in paths or sorted(glob.glob('/dev/input/event*')):
+            try:
+                fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            except OSError as e:
+                logging.debug(f"can't open '{path}': {e}")
+                continue
+            try:
+                fcntl.ioctl(fd, EVIOCSCLOCKID, struct.pack('i', time.CLOCK_MONOTONIC))
+            except OSError as e:
+                logging.warning(f"'{path}' can't report monotonic timestamps, skipping it: {e}")
+                os.close(fd)
+                continue
+            self.selector.register(fd, selectors.EVENT_READ, path)
+        if not self.selector.get_map():
+            self.selector.close()
+            raise OSError('no readable input devices, reading /dev/input requires root or the input group')
+        logging.info(f'reading {len(self.selector.get_map())} input devices')
+        self.wake_reader, self.wake_writer = os.pipe()
+        self.selector.register(self.wake_reader, selectors.EVENT_READ, None)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+
+    def set_binds(self, bind_codes):
+        self.filter.set_binds(bind_codes)
+
+
+    def run(self):
+        put = self.event_queue.put_stamped
+        while self.running:
+            for key, _ in self.selector.select():
+                if key.data is None:
+                    continue
+                try:
+                    data = os.read(key.fd, EVENT.size * 64)
+                except BlockingIOError:
+                    continue
+                except OSError as e:
+                    # e.g. the device was unplugged
+                    logging.warning(f"stopped reading '{key.data}': {e}")
+                    self.selector.unregister(key.fd)
+                    os.close(key.fd)
+                    continue
+                for timestamp, key_input in self.filter.feed(data):
+                    put(timestamp, key_input)
+        for key in list(self.selector.get_map().values()):
+            os.close(key.fd)
+        self.selector.close()
+
+
+    def close(self):
+        self.running = False
+        os.write(self.wake_writer, b'\0')
+        self.thread.join()
+        os.close(self.wake_writer)
+
+
+def read_evdev_file(path, bind_codes, chunk_events=4096):
+    """
+    Yields the (timestamp, `KeyInput`) pairs of bound keys in a recording of raw evdev bytes,
+    e.g. made with `cat /dev/input/event3 > keys.evdev`.
+    """
+    evdev_filter = EvdevFilter(bind_codes)
+    with open(path, 'rb') as file:
+        while True:
+            data = file.read(EVENT.size * chunk_events)
+            if not data:
+                return
+            yield from evdev_filter.feed(data)
@@ -0,0 +1,93 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import sys
+
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+# watch descriptor, mask, cookie, length of the name following the header
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher():
+    """
+    Watches a file through inotify. The directory is watched rather than the file,
+    since editors often save by replacing the file.
+    """
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        directory = os.path.dirname(os.path.abspath(path))
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"failed to watch '{directory}'")
+        self.filename = os.fsencode(os.path.basename(path))
+
+
+    def changed(self):
+        """
+        Returns True if the file was written since the last call, without blocking.
+        """
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if name == self.filename:
+                    changed = True
+
+
+    def close(self):
+        os.close(self.fd)
+
+
+class MtimeWatcher():
+    """
+    Watches a file by polling its modification time and size.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.state = self.get_state()
+
+
+    def get_state(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            # e.g. while an editor replaces the file
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+
+    def changed(self):
+        state = self.get_state()
+        if state is None or state == self.state:
+            return False
+        self.state = state
+        return True
+
+
+    def close(self):
+        pass
+
+
+def create_watcher(path):
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(path)
+        except (OSError, AttributeError) as e:
+            logging.info(f'inotify is not available, polling for changes instead: {e}')
+    return MtimeWatcher(path)
@@ -1,16 +1,14 @@
 
+from collections import deque
 import keyboard as kb
 import mouse
 import logging
 from queue import Queue
 from _queue import Empty
 
-
-MOUSE_BUTTON_NAMES = {'left': 'Button-1', 
-                      'right':'Button-2', 
-                      'middle':'Button-3', 
-                      'x':'Button-X',
-                      'x2':'Button-X2'}
+import timing
+from timing import NS_PER_MS
+from utils import MOUSE_BUTTON_NAMES
 
 
 def workaround_read_event(suppress=False):
@@ -25,7 +23,8 @@ def workaround_read_event(suppress=False):
         logging.info('key binding timed out')
     finally:
         kb.unhook(kb_hooked)
-        mouse.unhook_all()
+        # only this hook, the bound mouse buttons stay hooked
+        mouse.unhook(mouse_hooked)
 
 
 def on_mouse_button(button, callback):
@@ -56,3 +55,105 @@ def hook_scan_code(scan_code, callback, suppress=False):
         store[scan_code].remove(callback)
     kb._hooks[callback] = kb._hooks[remove_] = remove_
     return remove_
+
+
+def hook_code(code, callback):
+    """
+    Hooks a bound scan code or mouse button. Returns the handle to pass to `unhook_code`.
+    """
+    if code in MOUSE_BUTTON_NAMES:
+        return on_mouse_button(code, callback)
+    # keyboard identifies hooks by their callback, so every key gets its own
+    return hook_scan_code(code, lambda event: callback(event))
+
+
+def unhook_code(code, handle):
+    if code in MOUSE_BUTTON_NAMES:
+        mouse._listener.remove_handler(handle)
+    else:
+        handle()
+
+
+class EventQueue:
+    """
+    Bounded queue between the input listener threads and the Tk mainloop.
+    `put` only stamps the event with the monotonic clock and appends it, so the listener never waits on
+    the GUI. Appends and pops on a deque are atomic, so no lock is taken.
+    Events arriving while the queue is full are dropped and counted, events
+    that waited longer than `late_ms` before being drained are counted as late.
+    """
+    def __init__(self, maxsize=4096, late_ms=50):
+        self.events = deque()
+        self.maxsize = maxsize
+        self.late_ns = late_ms * NS_PER_MS
+        self.n_dropped = 0
+        self.n_late = 0
+
+
+    def put(self, event):
+        timestamp = timing.now_ns()
+        if len(self.events) >= self.maxsize:
+            self.n_dropped += 1
+            return
+        self.events.append((timestamp, event))
+
+
+    def put_stamped(self, timestamp, event):
+        # for backends that bring their own timestamps
+        if len(self.events) >= self.maxsize:
+            self.n_dropped += 1
+            return
+        self.events.append((timestamp, event))
+
+
+    def drain(self, max_batch):
+        batch = []
+        now = timing.now_ns()
+        for _ in range(min(max_batch, len(self.events))):
+            timestamp, event = self.events.popleft()
+            if now - timestamp > self.late_ns:
+                self.n_late += 1
+            batch.append((timestamp, event))
+        return batch
+
+
+class InputHooks():
+    """
+    Hooks the bound keys, or reads them through evdev with `input.backend: evdev`, and queues
+    their events on `event_queue`. Created before the GUI is loaded, so input is captured
+    while Tk starts up, events wait on the queue with their timestamps until the mainloop runs.
+    """
+    def __init__(self, settings):
+        self.settings = settings
+        self.event_queue = EventQueue()
+        self.hooks = {}
+        self.evdev = None
+        if self.settings.input_backend == 'evdev':
+            # Linux only, reads /dev/input directly
+            from evdev_input import EvdevReader
+            try:
+                self.evdev = EvdevReader(self.event_queue, self.settings.bind_codes,
+                                         self.settings.input_devices)
+            except OSError as e:
+                logging.error(f'falling back to input hooks: {e}')
+        self.refresh()
+        self.first_hook_ns = timing.now_ns()
+
+
+    def refresh(self):
+        if self.evdev:
+            self.evdev.set_binds(self.settings.bind_codes)
+            return
+        # only codes that were bound or unbound since the last call are (un)hooked,
+        # every other key stays hooked throughout
+        codes = {code for code in self.settings.bind_codes if code}
+        for code in list(self.hooks):
+            if code not in codes:
+                unhook_code(code, self.hooks.pop(code))
+        for code in codes - self.hooks.keys():
+            self.hooks[code] = hook_code(code, self.event_queue.put)
+
+
+    def close(self):
+        if self.evdev:
+            self.evdev.close()
@@ -1,24 +1,91 @@
 
+import time
+# taken before any other import, for --profile-startup
+STARTUP_NS = time.perf_counter_ns()
+
+import argparse
 import logging
 import os
 import pickle
 
-from app import App
+from session import SessionReplay
 from setting_handler import SettingHandler, SETTINGS_PATH
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='4k mistake watcher')
+    parser.add_argument('--record', metavar='PATH',
+                        help='record all bound key events to a new session log')
+    parser.add_argument('--replay', metavar='PATH',
+                        help='replay a session log or an osu!mania .osr replay instead of reading keyboard input')
+    parser.add_argument('--speed', type=float, default=1,
+                        help='replay speed relative to real time, 0 replays as fast as possible')
+    parser.add_argument('--analyze', metavar='PATH',
+                        help='print a timing analysis of a session log and exit (requires numpy)')
+    parser.add_argument('--batch', metavar='DIR',
+                        help='print a summary of all session logs and .osr replays in a directory and exit')
+    parser.add_argument('--jobs', type=int,
+                        help='number of processes for --batch, all cores by default')
+    parser.add_argument('--beatmap', metavar='PATH',
+                        help='osu!mania beatmap to match presses against, live or with --analyze')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print the time to the first input hook and the first frame, then exit')
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s %(levelname)s %(funcName)s: %(message)s',
         datefmt='%H:%M:%S'
     )
     
+    # resolve user supplied paths before changing the working directory
+    record_path = args.record and os.path.abspath(args.record)
+    replay_path = args.replay and os.path.abspath(args.replay)
+    analyze_path = args.analyze and os.path.abspath(args.analyze)
+    beatmap_path = args.beatmap and os.path.abspath(args.beatmap)
+    batch_path = args.batch and os.path.abspath(args.batch)
     abspath = os.path.abspath(__file__)
     dirname = os.path.dirname(abspath)
     os.chdir(dirname)
+    if record_path and os.path.exists(record_path):
+        raise ValueError(f"'{record_path}' already exists, sessions are recorded to a new file each")
     settings = SettingHandler(SETTINGS_PATH)
-    app = App(settings)
+    if batch_path:
+        from batch import analyze_directory
+        print(analyze_directory(batch_path, settings, args.jobs).report())
+        return
+    beatmap = None
+    if beatmap_path:
+        from beatmap import load_beatmap
+        beatmap = load_beatmap(beatmap_path)
+        if beatmap.n_keys != settings.n_keys:
+            raise ValueError(f"'{beatmap_path}' has {beatmap.n_keys} keys, not {settings.n_keys}")
+    if analyze_path:
+        # numpy is only needed for offline analysis
+        from session_analysis import analyze_session
+        print(analyze_session(analyze_path, settings).report())
+        if beatmap:
+            from beatmap import analyze_hits
+            from session import read_session
+            print(analyze_hits(read_session(analyze_path), beatmap).report())
+        return
+    replay = None
+    if replay_path and replay_path.endswith('.osr'):
+        from osr import OsrReplay
+        replay = OsrReplay(replay_path, settings.n_keys, args.speed)
+    elif replay_path:
+        replay = SessionReplay(replay_path, settings.n_keys, args.speed)
+    # the input hooks are installed before tkinter is loaded, replays don't read input
+    inputs = None
+    if not replay:
+        from input_utils import InputHooks
+        inputs = InputHooks(settings)
+    from app import App
+    app = App(settings, inputs, record_path=record_path, replay=replay, beatmap=beatmap,
+              startup_ns=STARTUP_NS if args.profile_startup else None)
     try:
         app.mainloop()
     except KeyboardInterrupt:
@@ -1,20 +1,36 @@
 
-import copy
-from datetime import datetime
+from collections import namedtuple
 import logging
 
-from canvas_line import CanvasTextline
+from detector import KEYLOCK, REPEAT, SKIP
+import timing
+
+# binds and aliases at the time of a mistake, shared between all mistakes while they don't change
+KeySnapshot = namedtuple('KeySnapshot', ['binds', 'aliases'])
+
+
+def take_snapshot(settings):
+    return KeySnapshot(tuple(settings.bind_names), tuple(settings.aliases))
+
 
 class Mistake():
-    def __init__(self, settings, keyindices, time=None):
+    __slots__ = ('settings', 'keyindices', 'binds', 'aliases', 'timestamp')
+
+    def __init__(self, settings, keyindices, timestamp=None, snapshot=None):
         self.settings = settings
         self.keyindices = keyindices
-        self.binds = copy.deepcopy(self.settings.bind_names)
-        self.aliases = copy.deepcopy(self.settings.aliases)
-        if time is None:
-            self.time = datetime.now()
+        if snapshot is None:
+            snapshot = take_snapshot(settings)
+        self.binds = snapshot.binds
+        self.aliases = snapshot.aliases
+        # monotonic timestamp in ns, wall clock time is only derived for display
+        if timestamp is None:
+            self.timestamp = timing.now_ns()
         else:
-            self.time = time
+            self.timestamp = timestamp
+
+    def get_time_label(self):
+        return timing.to_datetime(self.timestamp).strftime('[%H:%M:%S] ')
             
     def get_display_values (self, key_display_method):
         match key_display_method:
@@ -33,26 +49,33 @@ class Mistake():
 
     def get_mistake_text(self):
         raise NotImplementedError()
+
+    def get_fragments(self):
+        # (text, fill) pairs making up the displayed line
+        raise NotImplementedError()
     
     def create_canvas_line(self, canvas, y):
-        raise NotImplementedError()
+        # tkinter is only loaded once there is a canvas, the input hooks are installed before that
+        from canvas_line import CanvasTextline
+        line = CanvasTextline(self.settings, canvas, y)
+        line.set_texts(self.get_fragments(), self)
+        return line
         
     
 class Keylock(Mistake):
+    __slots__ = ()
+
+    def __init__(self, settings, keyindices, timestamp=None, snapshot=None):
+        super().__init__(settings, keyindices, timestamp, snapshot)
     
-    def __init__(self, settings, keyindices, time=None):
-        super().__init__(settings, keyindices, time)
-    
-    def create_canvas_line(self, canvas, y):
+    def get_fragments(self):
         display_values = self.get_display_values(self.settings.key_display_method)
         colours = self.get_colours()
-        line = CanvasTextline(self.settings, canvas, y)
-        line.add_text(self.time.strftime('[%H:%M:%S] '), fill='gray')
-        line.add_text('keylocked ')
-        line.add_text(display_values[0], fill=colours[0])
-        line.add_text('-')
-        line.add_text(display_values[1], fill=colours[1])
-        return line
+        return [(self.get_time_label(), 'gray'),
+                ('keylocked ', 'black'),
+                (display_values[0], colours[0]),
+                ('-', 'black'),
+                (display_values[1], colours[1])]
 
     def get_mistake_text(self):
         key_numbers = self.get_display_values('key numbers')
@@ -60,21 +83,20 @@ class Keylock(Mistake):
     
     
 class Repeat(Mistake):
-    
-    def __init__(self, settings, keyindices, time=None):
+    __slots__ = ()
+
+    def __init__(self, settings, keyindices, timestamp=None, snapshot=None):
         if isinstance(keyindices, list):
-            super().__init__(settings, keyindices, time)
+            super().__init__(settings, keyindices, timestamp, snapshot)
         else:
-            super().__init__(settings, [keyindices], time)
+            super().__init__(settings, [keyindices], timestamp, snapshot)
     
-    def create_canvas_line(self, canvas, y):
+    def get_fragments(self):
         display_values = self.get_display_values(self.settings.key_display_method)
         colours = self.get_colours()
-        line = CanvasTextline(self.settings, canvas, y)
-        line.add_text(self.time.strftime('[%H:%M:%S] '), fill='gray')
-        line.add_text('repeated ')
-        line.add_text(display_values[0], fill=colours[0])
-        return line
+        return [(self.get_time_label(), 'gray'),
+                ('repeated ', 'black'),
+                (display_values[0], colours[0])]
 
     def get_mistake_text(self):
         key_numbers = self.get_display_values('key numbers')
@@ -82,25 +104,30 @@ class Repeat(Mistake):
     
     
 class Skip(Mistake):
-    
-    def __init__(self, settings, keyindices, time=None):
+    __slots__ = ()
+
+    def __init__(self, settings, keyindices, timestamp=None, snapshot=None):
         if isinstance(keyindices, list):
-            super().__init__(settings, keyindices, time)
+            super().__init__(settings, keyindices, timestamp, snapshot)
         else:
-            super().__init__(settings, [keyindices], time)
+            super().__init__(settings, [keyindices], timestamp, snapshot)
     
-    def create_canvas_line(self, canvas, y):
+    def get_fragments(self):
         display_values = self.get_display_values(self.settings.key_display_method)
         colours = self.get_colours()
-        line = CanvasTextline(self.settings, canvas, y)
-        line.add_text(self.time.strftime('[%H:%M:%S] '), fill='gray')
-        line.add_text('skipped ')
+        fragments = [(self.get_time_label(), 'gray'), ('skipped ', 'black')]
         for display_value, colour in zip(display_values[:-1], colours[:-1]):
-            line.add_text(display_value, fill=colour)
-            line.add_text(', ')
-        line.add_text(display_values[-1], fill=colours[-1])
-        return line
+            fragments.append((display_value, colour))
+            fragments.append((', ', 'black'))
+        fragments.append((display_values[-1], colours[-1]))
+        return fragments
 
     def get_mistake_text(self):
         key_numbers = self.get_display_values('key numbers')
-        return "skipped " + ", ".join(key_numbers)
\ No newline at end of file
+        return "skipped " + ", ".join(key_numbers)
+
+MISTAKE_CLASSES = {KEYLOCK: Keylock, REPEAT: Repeat, SKIP: Skip}
+
+
+def create_mistake(settings, record, snapshot=None):
+    return MISTAKE_CLASSES[record.type](settings, list(record.keyindices), record.timestamp, snapshot)
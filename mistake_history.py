@@ -0,0 +1,83 @@
+from array import array
+
+from detector import MistakeRecord
+from mistake import create_mistake, take_snapshot
+from utils import to_keymask, from_keymask
+
+
+class MistakeHistory():
+    """
+    Bounded history of mistakes, stored as array-backed columns of
+    (type code, first key, key bitmask, timestamp, snapshot index).
+    Once `max_mistakes` is reached, the oldest mistakes are overwritten.
+    Display objects are only created when a mistake is accessed by index.
+    """
+    def __init__(self, settings, max_mistakes):
+        self.settings = settings
+        self.max_mistakes = max_mistakes
+        # interned binds and aliases, a new snapshot is only added when they change
+        self.snapshots = []
+        self.snapshot_indices = {}
+        self.clear()
+
+
+    def clear(self):
+        self.types = array('B')
+        self.first_keys = array('B')
+        self.keymasks = array('Q')
+        self.timestamps = array('q')
+        self.snapshot_ids = array('I')
+        self.columns = (self.types, self.first_keys, self.keymasks, self.timestamps, self.snapshot_ids)
+        # position of the oldest mistake once the columns are full
+        self.start = 0
+        self.n_appended = 0
+
+
+    def __len__(self):
+        return len(self.types)
+
+
+    def get_snapshot_id(self):
+        snapshot = take_snapshot(self.settings)
+        snapshot_id = self.snapshot_indices.get(snapshot)
+        if snapshot_id is None:
+            snapshot_id = self.snapshot_indices[snapshot] = len(self.snapshots)
+            self.snapshots.append(snapshot)
+        return snapshot_id
+
+
+    def append(self, record):
+        """
+        Stores a `MistakeRecord`. Returns True if the oldest mistake was dropped to make room.
+        """
+        row = (record.type, record.keyindices[0], to_keymask(record.keyindices), record.timestamp,
+               self.get_snapshot_id())
+        self.n_appended += 1
+        if len(self.types) < self.max_mistakes:
+            for column, value in zip(self.columns, row):
+                column.append(value)
+            return False
+        for column, value in zip(self.columns, row):
+            column[self.start] = value
+        self.start = (self.start + 1) % len(self.types)
+        return True
+
+
+    def get_record(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('mistake index out of range')
+        j = (self.start + i) % len(self.types)
+        keyindices = from_keymask(self.first_keys[j], self.keymasks[j], self.settings.n_keys)
+        return MistakeRecord(self.types[j], keyindices, self.timestamps[j]), self.snapshot_ids[j]
+
+
+    def __getitem__(self, i):
+        record, snapshot_id = self.get_record(i)
+        return create_mistake(self.settings, record, self.snapshots[snapshot_id])
+
+
+    def sequence_number(self, i):
+        # identifies a mistake independently of how many older mistakes were dropped
+        return self.n_appended - len(self) + i
@@ -0,0 +1,183 @@
+from collections import namedtuple
+import logging
+import lzma
+import struct
+
+from detector import MistakeDetector
+from session import SessionEvent, SessionReplay
+import timing
+from timing import NS_PER_MS
+
+
+MANIA_MODE = 3
+# frame delta of the frame carrying the RNG seed instead of input
+SEED_FRAME = -12345
+# replays start with placeholder frames at this y, their x isn't a key bitmask
+PLACEHOLDER_Y = b'-500'
+# .NET ticks of 100ns at the unix epoch
+UNIX_EPOCH_TICKS = 621355968000000000
+# mania key count mods
+KEY_MODS = {1 << 26: 1, 1 << 28: 2, 1 << 27: 3, 1 << 15: 4, 1 << 16: 5, 1 << 17: 6, 1 << 18: 7,
+            1 << 19: 8, 1 << 24: 9}
+
+BYTE = struct.Struct('<B')
+SHORT = struct.Struct('<H')
+INT = struct.Struct('<i')
+LONG = struct.Struct('<q')
+
+ReplayHeader = namedtuple('ReplayHeader', [
+    'mode', 'version', 'beatmap_md5', 'player', 'replay_md5', 'n_300', 'n_100', 'n_50', 'n_geki',
+    'n_katu', 'n_miss', 'score', 'max_combo', 'perfect', 'mods', 'life_bar', 'wall_ns', 'data_length'])
+
+
+def read_struct(file, fmt):
+    data = file.read(fmt.size)
+    if len(data) < fmt.size:
+        raise ValueError(f"'{file.name}' is truncated")
+    return fmt.unpack(data)[0]
+
+
+def read_string(file):
+    # 0x00 for no string, or 0x0b followed by the ULEB128 encoded length and utf-8 bytes
+    if read_struct(file, BYTE) == 0:
+        return ''
+    length = 0
+    shift = 0
+    while True:
+        byte = read_struct(file, BYTE)
+        length |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    return file.read(length).decode('utf-8', errors='replace')
+
+
+def read_replay_header(file):
+    """
+    Reads the header of an .osr file, leaving the file at the start of the compressed frames.
+    """
+    return ReplayHeader(
+        mode=read_struct(file, BYTE),
+        version=read_struct(file, INT),
+        beatmap_md5=read_string(file),
+        player=read_string(file),
+        replay_md5=read_string(file),
+        n_300=read_struct(file, SHORT),
+        n_100=read_struct(file, SHORT),
+        n_50=read_struct(file, SHORT),
+        n_geki=read_struct(file, SHORT),
+        n_katu=read_struct(file, SHORT),
+        n_miss=read_struct(file, SHORT),
+        score=read_struct(file, INT),
+        max_combo=read_struct(file, SHORT),
+        perfect=bool(read_struct(file, BYTE)),
+        mods=read_struct(file, INT),
+        life_bar=read_string(file),
+        wall_ns=(read_struct(file, LONG) - UNIX_EPOCH_TICKS) * 100,
+        data_length=read_struct(file, INT))
+
+
+def mod_key_count(mods):
+    """
+    Returns the key count forced by the mods, or None if the map's own key count is played.
+    """
+    for mod, n_keys in KEY_MODS.items():
+        if mods & mod:
+            return n_keys
+    return None
+
+
+def decompress_frames(file, length, chunk_size=1 << 16):
+    """
+    Decompresses the LZMA frame data incrementally and yields the raw frames.
+    At most `chunk_size` bytes are read or decompressed at once, so memory stays flat on long replays.
+    """
+    decompressor = lzma.LZMADecompressor(lzma.FORMAT_ALONE)
+    rest = b''
+    while not decompressor.eof:
+        chunk = b''
+        if decompressor.needs_input:
+            if not length:
+                break
+            chunk = file.read(min(chunk_size, length))
+            if not chunk:
+                logging.warning(f"'{file.name}' ends within the replay data")
+                break
+            length -= len(chunk)
+        rest += decompressor.decompress(chunk, chunk_size)
+        *frames, rest = rest.split(b',')
+        yield from frames
+    if rest:
+        yield rest
+
+
+def read_frames(file, length, chunk_size=1 << 16):
+    """
+    Yields (time in ms, key bitmask) per frame, frames are 'delta ms|keys|y|z'.
+    """
+    time_ms = 0
+    for frame in decompress_frames(file, length, chunk_size):
+        fields = frame.split(b'|')
+        if len(fields) != 4:
+            continue
+        delta_ms = int(fields[0])
+        if delta_ms == SEED_FRAME:
+            continue
+        time_ms += delta_ms
+        if fields[2] == PLACEHOLDER_Y:
+            continue
+        yield time_ms, int(float(fields[1]))
+
+
+def read_replay(path, n_keys, chunk_size=1 << 16):
+    """
+    Yields the key down and key up events of an osu!mania replay as `SessionEvent`s,
+    timestamped on the monotonic clock relative to when the replay was played.
+    The code of every event is None.
+    """
+    with open(path, 'rb') as file:
+        header = read_replay_header(file)
+        if header.mode != MANIA_MODE:
+            raise ValueError(f"'{path}' is not an osu!mania replay")
+        forced_n_keys = mod_key_count(header.mods)
+        if forced_n_keys is not None and forced_n_keys != n_keys:
+            raise ValueError(f"'{path}' was played with {forced_n_keys} keys, not {n_keys}")
+        start_ns = timing.from_wall_ns(header.wall_ns)
+        key_mask = (1 << n_keys) - 1
+        warned = False
+        keys = 0
+        for time_ms, frame_keys in read_frames(file, header.data_length, chunk_size):
+            if frame_keys & ~key_mask and not warned:
+                logging.warning(f"'{path}' has presses beyond {n_keys} keys, they are ignored")
+                warned = True
+            frame_keys &= key_mask
+            changed = keys ^ frame_keys
+            if not changed:
+                continue
+            timestamp = start_ns + time_ms * NS_PER_MS
+            # releases first, keys released and pressed within one frame don't overlap
+            for is_down, mask in ((False, changed & keys), (True, changed & frame_keys)):
+                while mask:
+                    bit = mask & -mask
+                    mask ^= bit
+                    yield SessionEvent(timestamp, None, bit.bit_length() - 1, is_down)
+            keys = frame_keys
+
+
+def detect_replay_mistakes(path, settings):
+    """
+    Yields the `MistakeRecord`s of a replay, found by the same detector as live input.
+    """
+    detector = MistakeDetector(settings)
+    for event in read_replay(path, settings.n_keys):
+        mistakes = detector.feed(event.keyindex, event.is_down, event.timestamp)
+        if mistakes:
+            yield from mistakes
+
+
+class OsrReplay(SessionReplay):
+    """
+    Replays an .osr file like a session log.
+    """
+    def read_events(self, path, n_keys):
+        return read_replay(path, n_keys)
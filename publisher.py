@@ -0,0 +1,264 @@
+from collections import deque, namedtuple
+import logging
+import os
+from queue import SimpleQueue, Empty
+import selectors
+import socket
+import struct
+import threading
+
+import timing
+from detector import MistakeRecord
+from utils import to_keymask, from_keymask
+
+
+MAGIC = b'4kmp'
+VERSION = 1
+# magic, version, key count, sent once to every new subscriber
+HEADER = struct.Struct('<4sHH')
+# kind, then for key events: key index, 1 for key down and 0 for key up, unused
+# and for mistakes: mistake type, first key, key bitmask.
+# timestamps are wall clock ns since the epoch
+MESSAGE = struct.Struct('<BBBxIq')
+EVENT_MESSAGE = 0
+MISTAKE_MESSAGE = 1
+
+TCP_FALLBACK_ADDRESS = '127.0.0.1:47400'
+
+EventMessage = namedtuple('EventMessage', ['keyindex', 'is_down', 'timestamp'])
+
+
+def encode_event(keyindex, is_down, timestamp):
+    return MESSAGE.pack(EVENT_MESSAGE, keyindex, is_down, 0, timing.to_wall_ns(timestamp))
+
+
+def encode_mistake(record):
+    return MESSAGE.pack(MISTAKE_MESSAGE, record.type, record.keyindices[0],
+                        to_keymask(record.keyindices), timing.to_wall_ns(record.timestamp))
+
+
+def decode_message(data, n_keys):
+    """
+    Returns an `EventMessage` or a `MistakeRecord`, with timestamps on the local monotonic clock.
+    """
+    kind, value, first, keymask, wall_ns = MESSAGE.unpack(data)
+    timestamp = timing.from_wall_ns(wall_ns)
+    if kind == EVENT_MESSAGE:
+        return EventMessage(value, bool(first), timestamp)
+    return MistakeRecord(value, from_keymask(first, keymask, n_keys), timestamp)
+
+
+def parse_address(address):
+    """
+    Returns (family, address). 'host:port' is a TCP address, anything else the path of a unix socket.
+    Without unix sockets, e.g. on older versions of Windows, paths fall back to a local TCP port.
+    """
+    if ':' in address and os.path.sep not in address:
+        host, port = address.rsplit(':', 1)
+        return socket.AF_INET, (host, int(port))
+    if not hasattr(socket, 'AF_UNIX'):
+        logging.info(f'unix sockets are not supported, publishing on {TCP_FALLBACK_ADDRESS}')
+        return parse_address(TCP_FALLBACK_ADDRESS)
+    return socket.AF_UNIX, address
+
+
+class Subscriber():
+    """
+    A connected client with its own bounded buffer of messages waiting to be sent.
+    With the 'oldest' drop policy a full buffer drops its oldest message, with 'newest' the new one.
+    """
+    def __init__(self, sock, max_buffered, drop_policy):
+        self.sock = sock
+        self.buffer = deque()
+        self.max_buffered = max_buffered
+        self.drop_oldest = drop_policy == 'oldest'
+        # part of a message that could only be sent partially
+        self.pending = b''
+        self.n_dropped = 0
+
+
+    def push(self, message):
+        if len(self.buffer) >= self.max_buffered:
+            self.n_dropped += 1
+            if not self.drop_oldest:
+                return
+            self.buffer.popleft()
+        self.buffer.append(message)
+
+
+    def flush(self):
+        """
+        Sends as much as the socket accepts without blocking. Returns True if everything was sent.
+        """
+        while self.pending or self.buffer:
+            if not self.pending:
+                self.pending = b''.join(self.buffer)
+                self.buffer.clear()
+            try:
+                n_sent = self.sock.send(self.pending)
+            except BlockingIOError:
+                return False
+            self.pending = self.pending[n_sent:]
+        return True
+
+
+class Publisher():
+    """
+    Streams mistakes and optionally key events to any number of local subscribers.
+    `publish_event` and `publish_mistake` only put the encoded message on a queue,
+    a background thread fans it out to every subscriber without ever blocking on one,
+    so a slow subscriber only loses its own messages, see `Subscriber`.
+    """
+    def __init__(self, address, n_keys, max_buffered=4096, drop_policy='oldest'):
+        if drop_policy not in ('oldest', 'newest'):
+            raise ValueError(f"unknown drop policy '{drop_policy}'")
+        self.n_keys = n_keys
+        self.max_buffered = max_buffered
+        self.drop_policy = drop_policy
+        self.family, self.address = parse_address(address)
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            # left over from an earlier run
+            os.unlink(self.address)
+        self.server = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_INET:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(self.address)
+        self.server.listen()
+        self.server.setblocking(False)
+        self.messages = SimpleQueue()
+        self.subscribers = []
+        self.n_dropped_closed = 0
+        # wakes up the publisher thread when messages are queued while it is waiting
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.waiting = False
+        self.running = True
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server, selectors.EVENT_READ, 'accept')
+        self.selector.register(self.wake_reader, selectors.EVENT_READ, 'wake')
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        logging.info(f'publishing mistakes on {address}')
+
+
+    def publish_event(self, keyindex, is_down, timestamp):
+        self.publish(encode_event(keyindex, is_down, timestamp))
+
+
+    def publish_mistake(self, record):
+        self.publish(encode_mistake(record))
+
+
+    def publish(self, message):
+        self.messages.put(message)
+        if self.waiting:
+            self.waiting = False
+            self.wake()
+
+
+    def wake(self):
+        try:
+            self.wake_writer.send(b'\0')
+        except BlockingIOError:
+            # a wake up is already pending
+            pass
+
+
+    def run(self):
+        while self.running:
+            self.waiting = True
+            # messages queued right before waiting would otherwise wait for the next wake up
+            timeout = 0 if not self.messages.empty() else None
+            for key, mask in self.selector.select(timeout):
+                if key.data == 'accept':
+                    self.accept()
+                elif key.data == 'wake':
+                    self.drain_wake()
+                elif mask & selectors.EVENT_READ:
+                    self.receive(key.data)
+                elif mask & selectors.EVENT_WRITE:
+                    self.send(key.data)
+            self.waiting = False
+            self.fan_out()
+        for subscriber in list(self.subscribers):
+            self.disconnect(subscriber)
+        self.selector.close()
+
+
+    def accept(self):
+        try:
+            sock, _ = self.server.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        subscriber = Subscriber(sock, self.max_buffered, self.drop_policy)
+        subscriber.pending = HEADER.pack(MAGIC, VERSION, self.n_keys)
+        self.subscribers.append(subscriber)
+        self.selector.register(sock, selectors.EVENT_READ, subscriber)
+        logging.info(f'subscriber connected, {len(self.subscribers)} in total')
+        self.send(subscriber)
+
+
+    def drain_wake(self):
+        try:
+            while self.wake_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+
+    def receive(self, subscriber):
+        # subscribers don't send anything, reading only detects disconnects
+        try:
+            data = subscriber.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.disconnect(subscriber)
+
+
+    def fan_out(self):
+        while True:
+            try:
+                message = self.messages.get_nowait()
+            except Empty:
+                break
+            for subscriber in self.subscribers:
+                subscriber.push(message)
+        for subscriber in list(self.subscribers):
+            if subscriber.buffer or subscriber.pending:
+                self.send(subscriber)
+
+
+    def send(self, subscriber):
+        try:
+            done = subscriber.flush()
+        except OSError:
+            self.disconnect(subscriber)
+            return
+        # only wait for the socket to become writable while something is left to send
+        events = selectors.EVENT_READ if done else selectors.EVENT_READ | selectors.EVENT_WRITE
+        self.selector.modify(subscriber.sock, events, subscriber)
+
+
+    def disconnect(self, subscriber):
+        self.selector.unregister(subscriber.sock)
+        subscriber.sock.close()
+        self.subscribers.remove(subscriber)
+        self.n_dropped_closed += subscriber.n_dropped
+        logging.info(f'subscriber disconnected after {subscriber.n_dropped} dropped messages, '
+                     f'{len(self.subscribers)} left')
+
+
+    def close(self):
+        self.running = False
+        self.wake()
+        self.thread.join()
+        self.server.close()
+        self.wake_reader.close()
+        self.wake_writer.close()
+        if self.family == socket.AF_UNIX:
+            os.unlink(self.address)
@@ -0,0 +1,39 @@
+import logging
+import re
+
+from detector import MistakeRecord, possible_mistakes
+from mistake import create_mistake
+
+
+class RuleTable():
+    """
+    Periphery and sound rules, matched once against every mistake the detector can report.
+    Looking up the actions for a mistake is then a single dictionary access.
+    """
+    def __init__(self, settings):
+        periphery_rules = [(re.compile(rule['regex']), rule['colour'])
+                           for rule in settings.periphery_rules]
+        sound_rules = [(re.compile(rule['regex']), rule['filename'], rule['delay_ms'])
+                       for rule in settings.sound_rules]
+        # (type, keyindices) -> matching actions in rule order
+        self.colours = {}
+        self.sounds = {}
+        for mistake_type, keyindices in possible_mistakes(settings.n_keys):
+            record = MistakeRecord(mistake_type, keyindices, 0)
+            text = create_mistake(settings, record).get_mistake_text()
+            colours = tuple(colour for regex, colour in periphery_rules if regex.search(text))
+            sounds = tuple((filename, delay_ms) for regex, filename, delay_ms in sound_rules
+                           if regex.search(text))
+            if colours:
+                self.colours[(mistake_type, keyindices)] = colours
+            if sounds:
+                self.sounds[(mistake_type, keyindices)] = sounds
+        logging.info(f'compiled rules: {len(self.colours)} periphery and {len(self.sounds)} sound matches')
+
+
+    def get_colours(self, record):
+        return self.colours.get((record.type, record.keyindices), ())
+
+
+    def get_sounds(self, record):
+        return self.sounds.get((record.type, record.keyindices), ())
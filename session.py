@@ -0,0 +1,128 @@
+from collections import namedtuple
+import logging
+import struct
+
+import timing
+from utils import MOUSE_BUTTON_NAMES
+
+
+MAGIC = b'4kmw'
+VERSION = 1
+# magic, version, key count
+HEADER = struct.Struct('<4sHH')
+# monotonic timestamp in ns, scan code, key index, 1 for key down and 0 for key up
+EVENT = struct.Struct('<qHBB')
+# mouse buttons are stored after the range of keyboard scan codes
+MOUSE_CODE_OFFSET = 0xFF00
+MOUSE_BUTTONS = list(MOUSE_BUTTON_NAMES)
+
+SessionEvent = namedtuple('SessionEvent', ['timestamp', 'code', 'keyindex', 'is_down'])
+
+
+def encode_code(code):
+    if code in MOUSE_BUTTON_NAMES:
+        return MOUSE_CODE_OFFSET + MOUSE_BUTTONS.index(code)
+    return code
+
+
+def decode_code(code):
+    if code >= MOUSE_CODE_OFFSET:
+        return MOUSE_BUTTONS[code - MOUSE_CODE_OFFSET]
+    return code
+
+
+class SessionRecorder():
+    """
+    Binary log of all bound key events of a session.
+    Every session gets its own file, existing files are never appended to, since
+    the monotonic timestamps of a later run don't continue those of an earlier one.
+    """
+    def __init__(self, path, n_keys):
+        self.path = path
+        self.file = open(path, 'xb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, n_keys))
+        self.n_events = 0
+        logging.info(f"recording session to '{path}'")
+
+
+    def record(self, code, keyindex, is_down, timestamp):
+        self.file.write(EVENT.pack(timestamp, encode_code(code), keyindex, is_down))
+        self.n_events += 1
+
+
+    def close(self):
+        self.file.close()
+        logging.info(f"recorded {self.n_events} events to '{self.path}'")
+
+
+def read_header(file):
+    header = file.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError(f"'{file.name}' is not a session log")
+    magic, version, n_keys = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError(f"'{file.name}' is not a session log")
+    if version != VERSION:
+        raise ValueError(f"unsupported session log version {version}")
+    return n_keys
+
+
+def check_header(path, n_keys):
+    with open(path, 'rb') as file:
+        logged_n_keys = read_header(file)
+    if logged_n_keys != n_keys:
+        raise ValueError(f"'{path}' was recorded with {logged_n_keys} keys, not {n_keys}")
+
+
+def read_session(path, chunk_events=4096):
+    """
+    Yields the `SessionEvent`s of a session log, reading the file in chunks.
+    """
+    with open(path, 'rb') as file:
+        read_header(file)
+        chunk_size = chunk_events * EVENT.size
+        while chunk := file.read(chunk_size):
+            usable = len(chunk) - len(chunk) % EVENT.size
+            if usable != len(chunk):
+                logging.warning(f"'{path}' ends with a truncated event")
+            for timestamp, code, keyindex, is_down in EVENT.iter_unpack(chunk[:usable]):
+                yield SessionEvent(timestamp, decode_code(code), keyindex, bool(is_down))
+
+
+class SessionReplay():
+    """
+    Releases the events of a session log when a virtual clock running at `speed`
+    times real time reaches their recorded timestamps. A speed of 0 replays as fast
+    as possible. Events keep their recorded timestamps, so all timing logic
+    reproduces exactly regardless of the speed.
+    """
+    def __init__(self, path, n_keys, speed=1):
+        self.path = path
+        self.speed = speed
+        self.events = self.read_events(path, n_keys)
+        self.next_event = next(self.events, None)
+        self.clock = None
+        self.n_replayed = 0
+
+
+    def read_events(self, path, n_keys):
+        check_header(path, n_keys)
+        return read_session(path)
+
+
+    def due(self, max_batch):
+        if self.clock is None and self.next_event is not None:
+            self.clock = timing.VirtualClock(self.next_event.timestamp, self.speed)
+        batch = []
+        now = self.clock() if self.clock else 0
+        while self.next_event is not None and len(batch) < max_batch:
+            if self.next_event.timestamp > now:
+                break
+            batch.append(self.next_event)
+            self.next_event = next(self.events, None)
+        self.n_replayed += len(batch)
+        return batch
+
+
+    def is_done(self):
+        return self.next_event is None
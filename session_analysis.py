@@ -0,0 +1,205 @@
+import numpy as np
+
+from session import EVENT, HEADER, read_header
+from timing import NS_PER_MS, NS_PER_S
+
+
+EVENT_DTYPE = np.dtype([
+    ('timestamp', '<i8'), ('code', '<u2'), ('keyindex', 'u1'), ('is_down', 'u1')])
+assert EVENT_DTYPE.itemsize == EVENT.size
+
+PERCENTILES = [5, 25, 50, 75, 95]
+
+
+def load_session_arrays(path):
+    """
+    Loads the events of a session log into a structured array. Clear key events are dropped.
+    """
+    with open(path, 'rb') as file:
+        n_keys = read_header(file)
+    events = np.fromfile(path, dtype=EVENT_DTYPE, offset=HEADER.size)
+    return n_keys, events[events['keyindex'] < n_keys]
+
+
+class SessionAnalysis():
+    """
+    Timing analysis of a whole session, computed in vectorized passes.
+    Per column k:
+    - `intervals_ms[k]`: times from a press of key k to a correct press of key k+1,
+      the live analysis bars call their mean `presses_ms`
+    - `holds_ms[k]`: hold durations of key k, their mean is `releases_ms`
+    - `keylock_ratio[k]`: share of holds of key k that were still held at the next press of key k+2
+    Mistake counts are binned over time in windows of `window_s` seconds.
+    """
+    def __init__(self, n_keys, events, do_full_release=True, release_seconds=2, window_s=10):
+        self.n_keys = n_keys
+        self.window_s = window_s
+        all_timestamps = timestamps = np.ascontiguousarray(events['timestamp'])
+        keyindices = np.ascontiguousarray(events['keyindex'])
+        is_down = events['is_down'].astype(bool)
+
+        # group events by key while keeping their order in time, to find each key's previous state.
+        # held keys repeat their key down events, only the first one counts as a press
+        by_key = np.argsort(keyindices, kind='stable')
+        key_sorted = keyindices[by_key]
+        down_sorted = is_down[by_key]
+        was_down = np.zeros(len(by_key), dtype=bool)
+        was_down[1:] = down_sorted[:-1] & (key_sorted[1:] == key_sorted[:-1])
+        real_sorted = down_sorted != was_down
+        real = np.empty(len(by_key), dtype=bool)
+        real[by_key] = real_sorted
+        # like the detector, every key up while no key is held restarts the full release period
+        last_up = np.maximum.accumulate(np.where(is_down, -1, timestamps))
+        last_up = np.concatenate(([-1], last_up[:-1]))[real]
+        timestamps = timestamps[real]
+        keyindices = keyindices[real]
+        is_down = is_down[real]
+        # the same events grouped by key, after filtering each key's events alternate between down and up
+        by_key = by_key[real_sorted]
+        key_sorted = key_sorted[real_sorted]
+        down_sorted = down_sorted[real_sorted]
+        time_sorted = all_timestamps[by_key]
+        key_bounds = np.searchsorted(key_sorted, np.arange(n_keys + 1))
+
+        # number of keys held before each event, presses after a long enough full release are ignored
+        n_held = np.cumsum(np.where(is_down, 1, -1))
+        held_before = np.concatenate(([0], n_held[:-1]))
+        ignored = np.zeros(len(timestamps), dtype=bool)
+        if do_full_release:
+            ignored = is_down & (held_before == 0) & (last_up >= 0)
+            ignored &= timestamps - last_up >= release_seconds * NS_PER_S
+
+        press_times = timestamps[is_down]
+        press_keys = keyindices[is_down].astype(np.intp)
+        press_ignored = ignored[is_down]
+        self.n_presses = len(press_times)
+        self.duration_s = (timestamps[-1] - timestamps[0]) / NS_PER_S if len(timestamps) else 0
+
+        # inter-press intervals, only between correctly ordered presses
+        prev_keys = press_keys[:-1]
+        next_keys = press_keys[1:]
+        correct = (next_keys == (prev_keys + 1) % n_keys) & (next_keys != prev_keys)
+        correct &= ~press_ignored[:-1] & ~press_ignored[1:]
+        intervals = np.diff(press_times) / NS_PER_MS
+        self.intervals_ms = split_by_key(intervals[correct], prev_keys[correct], n_keys)
+
+        # hold durations and keylocks, i.e. holds overlapping the next press of the key two columns further
+        self.holds_ms = []
+        self.keylock_ratio = np.zeros(n_keys)
+        self.keylock_overlap_ms = np.zeros(n_keys)
+        key_times = [time_sorted[key_bounds[k]:key_bounds[k + 1]] for k in range(n_keys)]
+        key_downs = [down_sorted[key_bounds[k]:key_bounds[k + 1]] for k in range(n_keys)]
+        for k in range(n_keys):
+            times = key_times[k]
+            downs = key_downs[k]
+            hold_mask = downs[:-1] & ~downs[1:]
+            hold_starts = times[:-1][hold_mask]
+            hold_ends = times[1:][hold_mask]
+            self.holds_ms.append((hold_ends - hold_starts) / NS_PER_MS)
+            if not len(hold_starts):
+                continue
+            other = (k + 2) % n_keys
+            other_presses = key_times[other][key_downs[other]]
+            next_i = np.searchsorted(other_presses, hold_starts, side='right')
+            next_press = np.append(other_presses, np.iinfo(np.int64).max)[next_i]
+            overlap = np.maximum(0, hold_ends - next_press) / NS_PER_MS
+            keylocked = overlap > 0
+            self.keylock_ratio[k] = keylocked.mean()
+            self.keylock_overlap_ms[k] = overlap[keylocked].mean() if keylocked.any() else 0
+
+        # mistakes, using the same rules as the detector
+        counted = ~press_ignored
+        repeats = np.zeros(self.n_presses, dtype=bool)
+        repeats[1:] = next_keys == prev_keys
+        skips = np.zeros(self.n_presses, dtype=bool)
+        skips[1:] = (next_keys != (prev_keys + 1) % n_keys) & ~repeats[1:]
+        keylocks = np.zeros(self.n_presses, dtype=bool)
+        for k in range(n_keys):
+            two_back = (k - 2) % n_keys
+            if two_back == k:
+                continue
+            # state of the key two columns back right before each press of key k
+            mask = press_keys == k
+            last = np.searchsorted(key_times[two_back], press_times[mask], side='left') - 1
+            keylocks[mask] = np.append(key_downs[two_back], False)[last]
+        self.mistake_times = {
+            'keylock': press_times[keylocks & counted],
+            'repeat': press_times[repeats & counted],
+            'skip': press_times[skips & counted],
+        }
+        start = timestamps[0] if len(timestamps) else 0
+        n_windows = max(1, int(np.ceil(self.duration_s / window_s)))
+        press_windows = ((press_times[counted] - start) // (window_s * NS_PER_S)).astype(np.intp)
+        self.presses_per_window = np.bincount(press_windows, minlength=n_windows)[:n_windows]
+        self.mistakes_per_window = {}
+        for name, times in self.mistake_times.items():
+            windows = ((times - start) // (window_s * NS_PER_S)).astype(np.intp)
+            self.mistakes_per_window[name] = np.bincount(windows, minlength=n_windows)[:n_windows]
+
+
+    def presses_ms(self):
+        return [robust_mean(values) for values in self.intervals_ms]
+
+
+    def releases_ms(self):
+        return [robust_mean(values) for values in self.holds_ms]
+
+
+    def percentiles(self, values_per_key):
+        return [np.percentile(values, PERCENTILES) if len(values) else np.full(len(PERCENTILES), np.nan)
+                for values in values_per_key]
+
+
+    def mistake_rates(self):
+        """
+        mistakes per press in each time window
+        """
+        presses = np.maximum(self.presses_per_window, 1)
+        return {name: counts / presses for name, counts in self.mistakes_per_window.items()}
+
+
+    def report(self):
+        lines = [f'{self.n_presses} presses over {self.duration_s:.1f}s']
+        presses_ms = self.presses_ms()
+        releases_ms = self.releases_ms()
+        interval_percentiles = self.percentiles(self.intervals_ms)
+        hold_percentiles = self.percentiles(self.holds_ms)
+        percentile_names = '/'.join(f'p{p}' for p in PERCENTILES)
+        for k in range(self.n_keys):
+            lines.append(
+                f'key {k + 1}: press {presses_ms[k]:.1f}ms, release {releases_ms[k]:.1f}ms, '
+                f'keylocked {100 * self.keylock_ratio[k]:.1f}% '
+                f'(avg overlap {self.keylock_overlap_ms[k]:.1f}ms)')
+            lines.append(
+                f'  intervals {percentile_names}: '
+                + ' '.join(f'{value:.1f}' for value in interval_percentiles[k]))
+            lines.append(
+                f'  holds {percentile_names}: '
+                + ' '.join(f'{value:.1f}' for value in hold_percentiles[k]))
+        for name, times in self.mistake_times.items():
+            rates = self.mistake_rates()[name]
+            worst = rates.max() if len(rates) else 0
+            lines.append(f'{name}s: {len(times)}, worst {self.window_s}s window: {100 * worst:.1f}%')
+        return '\n'.join(lines)
+
+
+def split_by_key(values, keyindices, n_keys):
+    order = np.argsort(keyindices, kind='stable')
+    bounds = np.searchsorted(keyindices[order], np.arange(1, n_keys))
+    return np.split(values[order], bounds)
+
+
+def robust_mean(values, outlier_ratio=2):
+    # vectorized counterpart of the live outlier filter in stats.py, dropping values
+    # above `outlier_ratio` times the median
+    if not len(values):
+        return 0
+    median = np.median(values)
+    inliers = values[values <= outlier_ratio * median]
+    return float(inliers.mean()) if len(inliers) else float(median)
+
+
+def analyze_session(path, settings, window_s=10):
+    n_keys, events = load_session_arrays(path)
+    return SessionAnalysis(n_keys, events, settings.do_full_release, settings.release_seconds,
+                           window_s)
@@ -1,8 +1,38 @@
+import copy
 import logging
 import math
 import yaml
 
+from rules import RuleTable
+
 SETTINGS_PATH = 'settings.yaml'
+# settings the rule table is compiled from, the mistake texts the rules match depend on the key settings
+RULE_SETTINGS = {'periphery_rules', 'sound_rules', 'bind_names', 'aliases', 'key_display_method'}
+# settings added after the first release, settings files from before them fall back to these
+DEFAULT_SETTINGS = {
+    'analysis': {'ewma_alpha': 0.1, 'max_fps': 60, 'outlier_ratio': 2, 'release_rows': 2},
+    'database': {'enabled': True, 'path': 'history.db'},
+    'diagnostics': {'dump_path': 'diagnostics.log', 'enabled': False},
+    'history': {'max_mistakes': 100000},
+    'input': {'backend': 'hooks', 'devices': []},
+    'publisher': {'address': 'mistake-watcher.sock', 'drop_policy': 'oldest', 'enabled': False,
+                  'events': False, 'max_buffered': 4096},
+    'sound': {'backend': 'device'},
+}
+
+
+def with_defaults(settings_data):
+    """
+    Returns the settings read from a file, with missing sections and keys of `DEFAULT_SETTINGS` filled in.
+    """
+    merged = copy.deepcopy(DEFAULT_SETTINGS)
+    for section, values in settings_data.items():
+        if isinstance(values, dict) and section in merged:
+            merged[section].update(values)
+        else:
+            merged[section] = values
+    return merged
+
 
 class SettingHandler:
     def __init__(self, settings_path=SETTINGS_PATH):
@@ -10,6 +40,33 @@ class SettingHandler:
         self._load_settings()
 
     def _load_settings(self):
+        self._apply_settings(self._read_settings())
+        self.rule_table = RuleTable(self)
+
+    def reload(self):
+        """
+        Re-reads the settings file and returns the names of the settings that changed.
+        Invalid files and key count changes, which need a restart, are rejected and return None.
+        """
+        old_values = self.get_values()
+        try:
+            self._apply_settings(self._read_settings())
+            changed = {name for name, value in self.get_values().items() if value != old_values[name]}
+            if 'n_keys' in changed:
+                raise ValueError('changing the key count requires a restart')
+            if changed & RULE_SETTINGS:
+                self.rule_table = RuleTable(self)
+        except Exception as e:
+            logging.error(f"Failed to reload settings: {e}")
+            self.__dict__.update(old_values)
+            return None
+        return changed
+
+    def get_values(self):
+        return {name: copy.deepcopy(value) for name, value in vars(self).items()
+                if name not in ('settings_path', 'rule_table')}
+
+    def _read_settings(self):
         try:
             logging.info(f"Attempting to load settings from '{self.settings_path}'")
             with open(self.settings_path, 'r') as file:
@@ -19,7 +76,9 @@ class SettingHandler:
             logging.info("Settings loaded successfully.")
         except FileNotFoundError:
             logging.warning(f"'{self.settings_path}' not found or is empty.")
+        return with_defaults(settings_data)
 
+    def _apply_settings(self, settings_data):
         self.n_keys = settings_data['keys']['count']
         self.bind_names = settings_data['keys']['bind_names']
         self.bind_codes = settings_data['keys']['bind_codes']
@@ -34,9 +93,36 @@ class SettingHandler:
         self.min_width = settings_data['display']['min_width']
         self.min_height = settings_data['display']['min_height']
 
+        self.max_mistakes = settings_data['history']['max_mistakes']
+
+        self.database_enabled = settings_data['database']['enabled']
+        self.database_path = settings_data['database']['path']
+
+        self.diagnostics_enabled = settings_data['diagnostics']['enabled']
+        self.diagnostics_dump_path = settings_data['diagnostics']['dump_path']
+
+        self.input_backend = settings_data['input']['backend']
+        self.input_devices = settings_data['input']['devices']
+
+        self.publisher_enabled = settings_data['publisher']['enabled']
+        self.publisher_address = settings_data['publisher']['address']
+        self.publisher_events = settings_data['publisher']['events']
+        self.publisher_max_buffered = settings_data['publisher']['max_buffered']
+        self.publisher_drop_policy = settings_data['publisher']['drop_policy']
+
         self.analysis_enabled = settings_data['analysis']['enabled']
         self.divider_stroke = settings_data['analysis']['divider_stroke']
         self.scale_mark_prominence = settings_data['analysis']['scale_mark_prominence']
+        self.analysis_max_fps = settings_data['analysis']['max_fps']
+        self.analysis_ewma_alpha = settings_data['analysis']['ewma_alpha']
+        self.analysis_outlier_ratio = settings_data['analysis']['outlier_ratio']
+        self.analysis_release_rows = settings_data['analysis']['release_rows']
+        if not self.analysis_max_fps > 0:
+            raise ValueError(f"analysis.max_fps must be above 0, not {self.analysis_max_fps}")
+        if not 0 < self.analysis_ewma_alpha <= 1:
+            raise ValueError(f"analysis.ewma_alpha must be above 0 and at most 1, not {self.analysis_ewma_alpha}")
+        if not isinstance(self.analysis_release_rows, int) or self.analysis_release_rows < 1:
+            raise ValueError(f"analysis.release_rows must be a whole number above 0, not {self.analysis_release_rows}")
 
         self.do_full_release = settings_data['behavior']['do_full_release']
         self.release_seconds = settings_data['behavior']['release_seconds']
@@ -45,6 +131,7 @@ class SettingHandler:
         self.periphery_background_colour = settings_data['periphery_mode']['background_colour']
         self.periphery_rules = settings_data['periphery_mode']['rules']
         self.sound_enabled = settings_data['sound']['enabled']
+        self.sound_backend = settings_data['sound']['backend']
         self.sound_rules = settings_data['sound']['rules']
 
 
@@ -66,6 +153,28 @@ class SettingHandler:
                 'min_width': self.min_width,
                 'min_height': self.min_height
             },
+            'history': {
+                'max_mistakes': self.max_mistakes,
+            },
+            'database': {
+                'enabled': self.database_enabled,
+                'path': self.database_path,
+            },
+            'diagnostics': {
+                'enabled': self.diagnostics_enabled,
+                'dump_path': self.diagnostics_dump_path,
+            },
+            'input': {
+                'backend': self.input_backend,
+                'devices': self.input_devices,
+            },
+            'publisher': {
+                'enabled': self.publisher_enabled,
+                'address': self.publisher_address,
+                'events': self.publisher_events,
+                'max_buffered': self.publisher_max_buffered,
+                'drop_policy': self.publisher_drop_policy,
+            },
             'behavior': {
                 'do_full_release': self.do_full_release,
                 'release_seconds': self.release_seconds,
@@ -74,6 +183,10 @@ class SettingHandler:
                 'enabled': self.analysis_enabled,
                 'divider_stroke': self.divider_stroke,
                 'scale_mark_prominence': self.scale_mark_prominence,
+                'max_fps': self.analysis_max_fps,
+                'ewma_alpha': self.analysis_ewma_alpha,
+                'outlier_ratio': self.analysis_outlier_ratio,
+                'release_rows': self.analysis_release_rows,
             },
             'periphery_mode': {
                 'enabled': self.periphery_mode_enabled,
@@ -83,6 +196,7 @@ class SettingHandler:
             },
             'sound': {
                 'enabled': self.sound_enabled,
+                'backend': self.sound_backend,
                 'rules': self.sound_rules,
             },
         }
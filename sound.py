@@ -0,0 +1,256 @@
+from collections import deque
+import heapq
+import itertools
+import logging
+from queue import SimpleQueue, Empty
+import threading
+import time
+import wave
+
+import miniaudio
+import numpy as np
+
+from diagnostics import diagnostics
+import timing
+from timing import NS_PER_MS, NS_PER_S
+
+
+SAMPLE_RATE = 44100
+N_CHANNELS = 2
+SAMPLE_WIDTH = 2
+BLOCK_FRAMES = 256
+
+
+def decode_clip(path):
+    """
+    Decodes a sound file to interleaved 16 bit stereo PCM at `SAMPLE_RATE`.
+    """
+    if path.endswith('.wav'):
+        with wave.open(path, 'rb') as file:
+            if file.getsampwidth() != SAMPLE_WIDTH or file.getframerate() != SAMPLE_RATE:
+                raise ValueError(f"'{path}' must be 16 bit at {SAMPLE_RATE} Hz")
+            samples = np.frombuffer(file.readframes(file.getnframes()), dtype=np.int16)
+            if file.getnchannels() == 1:
+                samples = np.repeat(samples, 2)
+            return samples
+    decoded = miniaudio.decode_file(path, output_format=miniaudio.SampleFormat.SIGNED16,
+                                    nchannels=N_CHANNELS, sample_rate=SAMPLE_RATE)
+    return np.frombuffer(decoded.samples, dtype=np.int16)
+
+
+def mix(clips, n_samples=None):
+    """
+    Sums int16 clips with clipping, padded with silence to `n_samples` or the longest clip.
+    The samples are added by numpy, so the Python work is per clip and not per sample.
+    """
+    if n_samples is None:
+        n_samples = max(len(clip) for clip in clips)
+    if len(clips) == 1 and len(clips[0]) == n_samples:
+        return clips[0]
+    sums = np.zeros(n_samples, dtype=np.int32)
+    for clip in clips:
+        sums[:len(clip)] += clip
+    np.clip(sums, -32768, 32767, out=sums)
+    return sums.astype(np.int16)
+
+
+class SoundEngine():
+    """
+    Plays preloaded clips through a pluggable output backend.
+    All clips are decoded once on creation. Clips triggered together with the same delay
+    are premixed and cached per combination, see `get_premixed`. Overlapping triggers 
+    are mixed block by block when rendered.
+    The time from a trigger becoming due to its first rendered sample is recorded
+    in `latencies_ns`.
+    """
+    def __init__(self, filenames, backend, sound_dir='sounds'):
+        self.sound_dir = sound_dir
+        self.clips = {}
+        self.premixed = {}
+        self.load_clips(filenames)
+        self.triggers = SimpleQueue()
+        self.trigger_ids = itertools.count()
+        # only touched while rendering
+        self.pending = []
+        self.voices = []
+        self.latencies_ns = deque(maxlen=1000)
+        self.silence = np.zeros(BLOCK_FRAMES * N_CHANNELS, dtype=np.int16)
+        self.backend = backend
+        self.backend.start(self.render)
+        logging.info(f'loaded {len(self.clips)} sounds')
+
+
+    def load_clips(self, filenames):
+        # clips that are already loaded are kept
+        n_clips = len(self.clips)
+        for filename in set(filenames) - self.clips.keys():
+            try:
+                self.clips[filename] = decode_clip(f'{self.sound_dir}/{filename}')
+            except Exception as e:
+                logging.error(f"failed to load sound '{filename}': {e}")
+        if len(self.clips) > n_clips:
+            # combinations may have been premixed without the new clips
+            self.premixed.clear()
+
+
+    def play(self, sounds):
+        """
+        Triggers (filename, delay_ms) pairs, e.g. the sounds of a rule table entry.
+        """
+        now = timing.now_ns()
+        for delay_ms, clip in self.get_premixed(sounds):
+            self.triggers.put((now + delay_ms * NS_PER_MS, clip))
+
+
+    def get_premixed(self, sounds):
+        # clips starting at the same time are mixed into one, once per combination
+        premixed = self.premixed.get(sounds)
+        if premixed is None:
+            delays = {}
+            for filename, delay_ms in sounds:
+                if filename in self.clips:
+                    delays.setdefault(delay_ms, []).append(self.clips[filename])
+            premixed = self.premixed[sounds] = [(delay_ms, mix(clips))
+                                                for delay_ms, clips in delays.items()]
+        return premixed
+
+
+    def render(self, n_frames):
+        """
+        Returns the next `n_frames` frames of output, called by the backend's audio thread.
+        """
+        now = timing.now_ns()
+        while True:
+            try:
+                due, clip = self.triggers.get_nowait()
+            except Empty:
+                break
+            heapq.heappush(self.pending, (due, next(self.trigger_ids), clip))
+        while self.pending and self.pending[0][0] <= now:
+            due, _, clip = heapq.heappop(self.pending)
+            self.voices.append([clip, 0])
+            latency_ns = now - due + self.backend.latency_ns
+            self.latencies_ns.append(latency_ns)
+            if diagnostics.enabled:
+                diagnostics.record('sound', latency_ns)
+
+        n_samples = n_frames * N_CHANNELS
+        if not self.voices:
+            if n_frames == BLOCK_FRAMES:
+                return self.silence
+            return np.zeros(n_samples, dtype=np.int16)
+        # slices of the clips are views, a lone voice is passed on without copying
+        block = mix([clip[position:position + n_samples] for clip, position in self.voices], n_samples)
+        for voice in self.voices:
+            voice[1] += n_samples
+        self.voices = [voice for voice in self.voices if voice[1] < len(voice[0])]
+        return block
+
+
+    def get_latency_ms(self):
+        if not self.latencies_ns:
+            return None
+        return sum(self.latencies_ns) / len(self.latencies_ns) / NS_PER_MS
+
+
+    def close(self):
+        self.backend.stop()
+        latency_ms = self.get_latency_ms()
+        if latency_ms is not None:
+            logging.info(f'average sound trigger to first sample latency: {latency_ms:.1f}ms')
+
+
+class DeviceBackend():
+    """
+    Plays to the default audio device through miniaudio, which pulls blocks from its own thread.
+    """
+    def __init__(self, buffersize_msec=10):
+        self.device = miniaudio.PlaybackDevice(
+            output_format=miniaudio.SampleFormat.SIGNED16, nchannels=N_CHANNELS,
+            sample_rate=SAMPLE_RATE, buffersize_msec=buffersize_msec)
+        self.latency_ns = buffersize_msec * NS_PER_MS
+
+
+    def start(self, render):
+        def stream():
+            n_frames = yield b''
+            while True:
+                n_frames = yield render(n_frames)
+        generator = stream()
+        next(generator)
+        self.device.start(generator)
+
+
+    def stop(self):
+        self.device.close()
+
+
+class ThreadedBackend():
+    """
+    Renders blocks in real time on a dedicated thread and passes them to `write`.
+    """
+    def __init__(self):
+        self.latency_ns = 0
+        self.running = False
+
+
+    def start(self, render):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, args=(render,), daemon=True)
+        self.thread.start()
+
+
+    def run(self, render):
+        block_ns = BLOCK_FRAMES * NS_PER_S // SAMPLE_RATE
+        next_block = timing.now_ns()
+        while self.running:
+            self.write(render(BLOCK_FRAMES))
+            next_block += block_ns
+            delay_ns = next_block - timing.now_ns()
+            if delay_ns > 0:
+                time.sleep(delay_ns / NS_PER_S)
+
+
+    def write(self, block):
+        raise NotImplementedError()
+
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+
+class NullBackend(ThreadedBackend):
+    def write(self, block):
+        pass
+
+
+class WavFileBackend(ThreadedBackend):
+    """
+    Writes the rendered output to a wav file instead of playing it.
+    """
+    def __init__(self, path):
+        super().__init__()
+        self.file = wave.open(path, 'wb')
+        self.file.setnchannels(N_CHANNELS)
+        self.file.setsampwidth(SAMPLE_WIDTH)
+        self.file.setframerate(SAMPLE_RATE)
+
+
+    def write(self, block):
+        self.file.writeframesraw(block.tobytes())
+
+
+    def stop(self):
+        super().stop()
+        self.file.close()
+
+
+def create_backend(name):
+    if name == 'device':
+        return DeviceBackend()
+    if name == 'null':
+        return NullBackend()
+    if name.endswith('.wav'):
+        return WavFileBackend(name)
+    raise ValueError(f"unknown sound backend '{name}'")
@@ -0,0 +1,207 @@
+import bisect
+import math
+
+from timing import NS_PER_MS
+
+
+class Ewma():
+    """
+    Exponentially weighted moving average, recent samples weigh `alpha`.
+    """
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.mean = None
+
+
+    def add(self, x):
+        if self.mean is None:
+            self.mean = x
+        else:
+            self.mean += self.alpha * (x - self.mean)
+
+
+class Welford():
+    """
+    Running mean and variance over all samples.
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = 0
+        self.m2 = 0
+
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+
+    def merge(self, other):
+        # Chan et al.'s pairwise update, as if `other`'s samples had been added here
+        n = self.n + other.n
+        if not n:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+
+
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0
+
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+
+class P2Quantile():
+    """
+    P² estimate of the `p` quantile in constant memory (Jain & Chlamtac, 1985).
+    """
+    def __init__(self, p):
+        self.p = p
+        # marker heights, actual and desired positions
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+
+    def add(self, x):
+        q = self.heights
+        if len(q) < 5:
+            bisect.insort(q, x)
+            return
+        n = self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = bisect.bisect_right(q, x) - 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        # adjust the middle markers if they drifted from their desired positions
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self.parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+
+    def parabolic(self, i, d):
+        q = self.heights
+        n = self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+
+    def value(self):
+        q = self.heights
+        if len(q) == 5:
+            return q[2]
+        if not q:
+            return None
+        # exact quantile of the first few samples
+        return q[round(self.p * (len(q) - 1))]
+
+
+class StreamingStats():
+    """
+    Constant memory statistics of a stream of timings. Median and p95 see every sample,
+    samples above `outlier_ratio` times the median are rejected from the mean and variance.
+    Since the median keeps following all samples, a lasting change in tempo is accepted again.
+    """
+    def __init__(self, alpha, outlier_ratio):
+        self.outlier_ratio = outlier_ratio
+        self.ewma = Ewma(alpha)
+        self.welford = Welford()
+        self.median = P2Quantile(0.5)
+        self.p95 = P2Quantile(0.95)
+        self.n_rejected = 0
+
+
+    def add(self, x):
+        median = self.median.value()
+        self.median.add(x)
+        self.p95.add(x)
+        if self.outlier_ratio and median is not None and x > self.outlier_ratio * median:
+            self.n_rejected += 1
+            return
+        self.ewma.add(x)
+        self.welford.add(x)
+
+
+    def mean(self):
+        return self.ewma.mean
+
+
+class TimingAnalysis():
+    """
+    Per-key press intervals and hold durations, updated in O(1) per event.
+    `presses_ms[k]` is the time from a press of key k to the next press of key k+1,
+    `releases_ms[k]` is how long key k is held.
+    """
+    def __init__(self, n_keys, alpha=0.1, outlier_ratio=2):
+        self.n_keys = n_keys
+        self.alpha = alpha
+        self.outlier_ratio = outlier_ratio
+        self.clear()
+
+
+    def clear(self):
+        self.press_stats = [StreamingStats(self.alpha, self.outlier_ratio) for _ in range(self.n_keys)]
+        self.release_stats = [StreamingStats(self.alpha, self.outlier_ratio) for _ in range(self.n_keys)]
+        self.press_times = [None] * self.n_keys
+        self.last_press_time = None
+
+
+    def press(self, keyindex, counted, timestamp):
+        """
+        `counted` is False for presses that are out of order, i.e. repeats or skips.
+        """
+        if self.last_press_time is not None and counted:
+            i = (keyindex - 1) % self.n_keys
+            self.press_stats[i].add((timestamp - self.last_press_time) / NS_PER_MS)
+        self.last_press_time = timestamp
+        self.press_times[keyindex] = timestamp
+
+
+    def release(self, keyindex, timestamp):
+        if self.press_times[keyindex] is not None:
+            self.release_stats[keyindex].add((timestamp - self.press_times[keyindex]) / NS_PER_MS)
+
+
+    def presses_ms(self):
+        # keys without samples yet show the average of the other keys
+        means = [stats.mean() for stats in self.press_stats]
+        fallback = average(means)
+        if fallback is None:
+            fallback = average([stats.mean() for stats in self.release_stats]) or 0
+        return [fallback if mean is None else mean for mean in means]
+
+
+    def releases_ms(self):
+        means = [stats.mean() for stats in self.release_stats]
+        fallback = average(means)
+        if fallback is None:
+            fallback = (average([stats.mean() for stats in self.press_stats]) or 0) * 3/2
+        return [fallback if mean is None else mean for mean in means]
+
+
+def average(values):
+    values = [value for value in values if value is not None]
+    if not values:
+        return None
+    return sum(values) / len(values)
@@ -0,0 +1,149 @@
+import argparse
+import socket
+import threading
+import time
+
+import timing
+from detector import MistakeRecord
+from publisher import (HEADER, MAGIC, MESSAGE, VERSION, Publisher, decode_message, encode_mistake,
+                       parse_address)
+
+
+MISTAKE_NAMES = ['keylock', 'repeat', 'skip']
+# messages published at once when measuring throughput
+PUBLISH_BATCH = 32
+
+
+def read_messages(address):
+    """
+    Connects to a publisher and yields its messages as `EventMessage`s and `MistakeRecord`s.
+    """
+    family, address = parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.connect(address)
+        with sock.makefile('rb') as file:
+            header = file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            magic, version, n_keys = HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f'{address} is not a mistake publisher')
+            while True:
+                data = file.read(MESSAGE.size)
+                if len(data) < MESSAGE.size:
+                    return
+                yield decode_message(data, n_keys)
+
+
+def print_messages(address):
+    for message in read_messages(address):
+        time_label = timing.to_datetime(message.timestamp).strftime('%H:%M:%S.%f')[:-3]
+        if isinstance(message, MistakeRecord):
+            keys = '-'.join(str(keyindex + 1) for keyindex in message.keyindices)
+            print(f'{time_label} {MISTAKE_NAMES[message.type]} {keys}')
+        else:
+            print(f"{time_label} key {message.keyindex + 1} {'down' if message.is_down else 'up'}")
+
+
+def measure_throughput(address, n_subscribers, n_messages, n_slow=1, max_buffered=256, rate=50000,
+                       slow_rate=5000, n_keys=4):
+    """
+    Publishes `n_messages` mistakes at `rate` messages/s to `n_subscribers` local clients reading
+    as fast as they can and `n_slow` clients reading only `slow_rate` messages/s, with `max_buffered`
+    messages buffered per client, so the drop policy kicks in for the slow ones.
+    Returns the rate of the publish calls alone, the rate at which the fast subscribers received
+    the messages, and the messages dropped for the fast and the slow subscribers.
+    The input path only pays for the publish calls.
+    """
+    publisher = Publisher(address, n_keys, max_buffered=max_buffered)
+    ready = threading.Barrier(n_subscribers + n_slow + 1)
+    # the last message differs from the others and is never dropped under the default 'oldest'
+    # policy, so every subscriber knows when it has received all it is going to get
+    timestamp = timing.now_ns()
+    record = MistakeRecord(0, (0, 2), timestamp)
+    last_record = MistakeRecord(0, (0, 2), timestamp + 1)
+    last_message = encode_mistake(last_record)
+    received = [0] * (n_subscribers + n_slow)
+    end_times = [0] * (n_subscribers + n_slow)
+
+    def subscribe(i, is_slow):
+        family, sock_address = parse_address(address)
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.connect(sock_address)
+            ready.wait()
+            n_bytes = 0
+            tail = b''
+            while True:
+                data = sock.recv(1 << 12 if is_slow else 1 << 16)
+                if not data:
+                    break
+                n_bytes += len(data)
+                tail = (tail + data)[-MESSAGE.size:]
+                if tail == last_message and (n_bytes - HEADER.size) % MESSAGE.size == 0:
+                    break
+                if is_slow:
+                    time.sleep(len(data) / MESSAGE.size / slow_rate)
+            received[i] = (n_bytes - HEADER.size) // MESSAGE.size
+            end_times[i] = time.perf_counter()
+
+    threads = [threading.Thread(target=subscribe, args=(i, i >= n_subscribers))
+               for i in range(n_subscribers + n_slow)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    while len(publisher.subscribers) < n_subscribers + n_slow:
+        time.sleep(0.001)
+    start = time.perf_counter()
+    publish_s = 0
+    for i in range(0, n_messages - 1, PUBLISH_BATCH):
+        # paced in small batches, a burst would overrun every buffer at once
+        delay_s = start + i / rate - time.perf_counter()
+        if delay_s > 0:
+            time.sleep(delay_s)
+        batch_start = time.perf_counter()
+        for _ in range(min(PUBLISH_BATCH, n_messages - 1 - i)):
+            publisher.publish_mistake(record)
+        publish_s += time.perf_counter() - batch_start
+    publisher.publish_mistake(last_record)
+    for thread in threads:
+        thread.join()
+    publisher.close()
+    fast_received = sum(received[:n_subscribers])
+    fast_s = max(end_times[:n_subscribers], default=start) - start
+    n_dropped_fast = n_messages * n_subscribers - fast_received
+    n_dropped_slow = n_messages * n_slow - sum(received[n_subscribers:])
+    # everything not received was dropped by the publisher, nothing is lost in transit
+    assert n_dropped_fast + n_dropped_slow == publisher.n_dropped_closed
+    return (n_messages / publish_s, fast_received / fast_s if fast_s > 0 else 0,
+            n_dropped_fast, n_dropped_slow)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='prints the mistakes streamed by the mistake watcher')
+    parser.add_argument('address', help="unix socket path or 'host:port' of the publisher")
+    parser.add_argument('--throughput', type=int, metavar='N_SUBSCRIBERS',
+                        help='instead, publish on the address and measure throughput with local subscribers')
+    parser.add_argument('--messages', type=int, default=100000,
+                        help='messages to publish when measuring throughput')
+    parser.add_argument('--slow', type=int, default=1,
+                        help='additional subscribers reading slowly when measuring throughput')
+    parser.add_argument('--max-buffered', type=int, default=256,
+                        help='messages buffered per subscriber when measuring throughput')
+    parser.add_argument('--rate', type=int, default=50000,
+                        help='messages/s to publish when measuring throughput')
+    args = parser.parse_args()
+    if args.throughput:
+        publish_rate, receive_rate, n_dropped_fast, n_dropped_slow = measure_throughput(
+            args.address, args.throughput, args.messages, args.slow, args.max_buffered, args.rate)
+        print(f'published {publish_rate:.0f} messages/s, '
+              f'delivered {receive_rate:.0f} messages/s to {args.throughput} subscribers, '
+              f'dropped {n_dropped_fast} for them and {n_dropped_slow} for {args.slow} slow subscribers')
+        return
+    try:
+        print_messages(args.address)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
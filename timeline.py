@@ -0,0 +1,89 @@
+from collections import namedtuple
+from math import ceil, gcd
+
+
+PRESSED = 'pressed'
+RELEASED = 'released'
+KEYLOCK = 'keylock'
+# sort order of boundaries at the same time
+RELEASE, PRESS, LATE_RELEASE = range(3)
+
+# a span of a row, `keyindex` is the held key, or else the last pressed key of the row
+Segment = namedtuple('Segment', ['row', 'start', 'end', 'kind', 'keyindex'])
+
+
+def periodic_cycles(n_keys, n_rows):
+    """
+    Returns the number of cycles after which the rows repeat, e.g. 1 for 4 keys on 2 rows, 2 for 7 keys.
+    """
+    return n_rows // gcd(n_keys, n_rows)
+
+
+def build_timeline(presses_ms, releases_ms, n_rows, n_cycles=1):
+    """
+    Lays out `n_cycles` cycles of a roll over all keys, where key i is pressed presses_ms[i - 1]
+    after key i - 1 and held for releases_ms[i]. Presses are dealt to the rows in turn, so that
+    with 2 rows the even and odd keys of a 4k roll get a row each. Each row is split into
+    pressed periods, released periods and keylocks, where presses on the same row overlap.
+    Holds reaching into the window from earlier cycles wrap around.
+    Returns a flat list of `Segment`s covering [0, cycle length * n_cycles) on every row,
+    ordered by row and start.
+    """
+    n_keys = len(presses_ms)
+    assert len(releases_ms) == n_keys
+    period = sum(presses_ms)
+    if period <= 0:
+        return []
+    end = period * n_cycles
+    offsets = [0] * n_keys
+    for i in range(1, n_keys):
+        offsets[i] = offsets[i - 1] + presses_ms[i - 1]
+
+    # earlier presses are included until every row has a release before the window and no hold reaches into it
+    first = -n_keys * (ceil(max(releases_ms) / period) + 1) - n_rows
+    # releases sort before presses at the same time, so touching holds are no keylock,
+    # except for the release of a zero length hold
+    boundaries = []
+    for j in range(first, n_keys * n_cycles):
+        keyindex = j % n_keys
+        start = (j // n_keys) * period + offsets[keyindex]
+        hold = releases_ms[keyindex]
+        boundaries.append((start, PRESS, j % n_rows, keyindex))
+        boundaries.append((start + hold, RELEASE if hold else LATE_RELEASE, j % n_rows, keyindex))
+    boundaries.sort()
+
+    rows = [[] for _ in range(n_rows)]
+    held = [[] for _ in range(n_rows)]
+    last_pressed = [None] * n_rows
+    cursors = [0] * n_rows
+
+    def emit(row, until):
+        start = cursors[row]
+        until = min(until, end)
+        if until <= start:
+            return
+        keys = held[row]
+        if not keys:
+            kind, keyindex = RELEASED, last_pressed[row]
+        elif len(keys) == 1:
+            kind, keyindex = PRESSED, keys[0]
+        else:
+            kind, keyindex = KEYLOCK, last_pressed[row]
+        segments = rows[row]
+        if segments and segments[-1].kind == kind and segments[-1].keyindex == keyindex:
+            segments[-1] = segments[-1]._replace(end=until)
+        else:
+            segments.append(Segment(row, start, until, kind, keyindex))
+        cursors[row] = until
+
+    for time, order, row, keyindex in boundaries:
+        if time > cursors[row]:
+            emit(row, time)
+        if order == PRESS:
+            held[row].append(keyindex)
+            last_pressed[row] = keyindex
+        else:
+            held[row].remove(keyindex)
+    for row in range(n_rows):
+        emit(row, end)
+    return [segment for segments in rows for segment in segments]
@@ -0,0 +1,48 @@
+from datetime import datetime
+import time
+
+
+NS_PER_MS = 1_000_000
+NS_PER_S = 1_000_000_000
+
+# monotonic clock used for all timing math. Events are stamped with it as soon as
+# the input hook sees them, so handler latency does not leak into the measurements.
+now_ns = time.perf_counter_ns
+
+# offset between wall clock and monotonic clock, fixed at startup so that all
+# labels derived from monotonic timestamps are consistent with each other
+_WALL_OFFSET_NS = time.time_ns() - now_ns()
+
+
+def to_wall_ns(timestamp_ns):
+    return timestamp_ns + _WALL_OFFSET_NS
+
+
+def from_wall_ns(wall_ns):
+    return wall_ns - _WALL_OFFSET_NS
+
+
+def to_datetime(timestamp_ns):
+    return datetime.fromtimestamp(to_wall_ns(timestamp_ns) / NS_PER_S)
+
+
+def from_datetime(dt):
+    return round(dt.timestamp() * NS_PER_S) - _WALL_OFFSET_NS
+
+
+class VirtualClock():
+    """
+    Clock running at `speed` times real time, starting at `start_ns`.
+    A speed of 0 means as fast as possible, the clock then is always infinitely far ahead.
+    """
+    def __init__(self, start_ns, speed=1, clock=now_ns):
+        self.start_ns = start_ns
+        self.speed = speed
+        self.clock = clock
+        self.wall_start_ns = clock()
+
+
+    def __call__(self):
+        if not self.speed:
+            return float('inf')
+        return self.start_ns + (self.clock() - self.wall_start_ns) * self.speed
@@ -1,9 +1,20 @@
 
+from collections import namedtuple
 from itertools import chain
 import logging
 import re
 
 
+MOUSE_BUTTON_NAMES = {'left': 'Button-1', 
+                      'right':'Button-2', 
+                      'middle':'Button-3', 
+                      'x':'Button-X',
+                      'x2':'Button-X2'}
+
+# an input already resolved to its bind, as delivered by the evdev backend
+KeyInput = namedtuple('KeyInput', ['code', 'keyindex', 'is_down'])
+
+
 def modular_range(modulus, start, end):
     start = start % modulus
     end = end % modulus
@@ -12,6 +23,18 @@ def modular_range(modulus, start, end):
     return chain(range(start, modulus), range(end))
 
 
+def to_keymask(keyindices):
+    keymask = 0
+    for keyindex in keyindices:
+        keymask |= 1 << keyindex
+    return keymask
+
+
+def from_keymask(first, keymask, n_keys):
+    # keys are ordered cyclically starting from the first key, e.g. keylocked 3-1 in 4k
+    return tuple(k % n_keys for k in range(first, first + n_keys) if keymask >> (k % n_keys) & 1)
+
+
 def is_hexcode(code):
     if not isinstance(code, str):
         logging.info('hexcode input is not a string')